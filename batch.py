@@ -0,0 +1,243 @@
+#!/bin/python
+"""
+Run many prompts through the sampling loop concurrently.
+
+Tasks are read from a JSONL file, one {"id": ..., "prompt": ...} object per line.
+Every session gets its own ComputerTool/BashTool/EditTool set bound to an X display
+taken from a pool (e.g. Xvfb servers :10 to :25), so at most one session drives a
+display at any time. Each task's transcript and exit status are written to
+<output-dir>/<id>.json, and a throughput summary to <output-dir>/summary.json.
+
+    python batch.py tasks.jsonl --displays 10-25 --concurrency 8 --output-dir runs/
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+from caching import PromptCacheTracker
+from conversation import Conversation
+from loop import (
+    PROVIDER_TO_DEFAULT_MODEL_NAME,
+    APIProvider,
+    close_clients,
+    sampling_loop,
+)
+from surrender import SYSTEM_PROMPT
+from tools.base import ToolResult
+from tools.bash import BashTool
+from tools.collection import ToolCollection
+from tools.computer import ComputerTool
+from tools.edit import EditTool
+from tools.tracing import tracer
+
+
+def parse_displays(spec: str) -> list[int]:
+    """Parse a display pool such as "10-25" or "10,12,14" into display numbers."""
+    displays: list[int] = []
+    for part in spec.split(","):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            displays.extend(range(int(first), int(last) + 1))
+        elif part.strip():
+            displays.append(int(part))
+    if not displays:
+        raise argparse.ArgumentTypeError(f"no display in {spec!r}")
+    return displays
+
+
+def load_tasks(path: Path) -> list[dict]:
+    tasks = []
+    with path.open() as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            task.setdefault("id", f"task-{line_number}")
+            if "prompt" not in task:
+                raise ValueError(f"{path}:{line_number}: task has no prompt")
+            tasks.append(task)
+    return tasks
+
+
+async def run_task(
+    task: dict,
+    displays: asyncio.Queue[int],
+    output_dir: Path,
+    *,
+    provider: APIProvider,
+    model: str,
+    api_key: str | None,
+    only_n_most_recent_images: int | None,
+) -> dict:
+    """Run one task on a free display and write its record. Returns the record without the transcript."""
+    display_num = await displays.get()
+    started = time.monotonic()
+    errors: list[str] = []
+    # passing a Conversation lets the loop extend it in place, so the transcript
+    # survives a crash
+    messages = Conversation(
+        [{"role": "user", "content": [{"type": "text", "text": task["prompt"]}]}]
+    )
+
+    def api_response_callback(
+        request: httpx.Request,
+        response: httpx.Response | object | None,
+        error: Exception | None,
+    ):
+        if error is not None:
+            errors.append(f"{type(error).__name__}: {error}")
+
+    settle_saved: list[float] = []
+    command_cpu: list[float] = []
+
+    def tool_output_callback(result: ToolResult, tool_id: str):
+        if result.metadata and "settle_saved_s" in result.metadata:
+            settle_saved.append(result.metadata["settle_saved_s"])
+        if result.metadata and "cpu_user_s" in result.metadata:
+            command_cpu.append(result.metadata["cpu_user_s"] + result.metadata["cpu_system_s"])
+
+    cache_tracker = PromptCacheTracker()
+
+    computer_tool = None
+    tool_collection = None
+    print(f"[{task['id']}] started on :{display_num}")
+    try:
+        computer_tool = ComputerTool(display_num=display_num, ascii_preview=False)
+        await computer_tool.ensure_initialized()
+        tool_collection = ToolCollection(
+            computer_tool,
+            BashTool(env={**os.environ, "DISPLAY": f":{display_num}"}),
+            EditTool(),
+        )
+        await sampling_loop(
+            model=model,
+            provider=provider,
+            system_prompt=SYSTEM_PROMPT,
+            messages=messages,
+            output_callback=lambda block: None,
+            tool_output_callback=tool_output_callback,
+            api_response_callback=api_response_callback,
+            api_key=api_key,
+            only_n_most_recent_images=only_n_most_recent_images,
+            tool_collection=tool_collection,
+            cache_tracker=cache_tracker,
+        )
+        # the loop returns early, without raising, when the API call fails; a
+        # finished session always ends on the assistant's last answer
+        status = "ok" if messages[-1]["role"] == "assistant" else "api_error"
+    except Exception as e:
+        status = "crashed"
+        errors.append("".join(traceback.format_exception(e)))
+    finally:
+        if tool_collection is not None:
+            await tool_collection.close()
+        displays.put_nowait(display_num)
+
+    record = {
+        "id": task["id"],
+        "prompt": task["prompt"],
+        "display_num": display_num,
+        "status": status,
+        "errors": errors,
+        "duration_s": round(time.monotonic() - started, 3),
+        "turns": sum(1 for message in messages if message["role"] == "assistant"),
+        "prompt_cache": cache_tracker.summary(),
+        "skipped_screenshots": computer_tool.skipped_screenshots if computer_tool else 0,
+        "settle_saved_s": round(sum(settle_saved), 3),
+        "command_cpu_s": round(sum(command_cpu), 3),
+    }
+    record_name = str(task["id"]).replace(os.sep, "_")
+    with (output_dir / f"{record_name}.json").open("w") as f:
+        json.dump({**record, "messages": messages}, f, indent=2, default=str)
+    print(f"[{task['id']}] {status} after {record['duration_s']}s")
+    return record
+
+
+def _overall_hit_ratio(records: list[dict]) -> float:
+    read = sum(r["prompt_cache"]["cache_read_input_tokens"] for r in records)
+    total = read + sum(
+        r["prompt_cache"]["input_tokens"] + r["prompt_cache"]["cache_creation_input_tokens"]
+        for r in records
+    )
+    return round(read / total, 3) if total else 0.0
+
+
+async def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run many surrender prompts concurrently")
+    parser.add_argument("tasks", type=Path, help="JSONL file of {\"id\", \"prompt\"} tasks")
+    parser.add_argument("--displays", type=parse_displays, default=parse_displays("10-25"), help="X display numbers to run sessions on, e.g. 10-25 or 10,11")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessions running at once, at most one per display")
+    parser.add_argument("--output-dir", type=Path, default=Path("debug") / f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    parser.add_argument("--only-n-most-recent-images", type=int, default=1)
+    parser.add_argument("--trace-dir", type=Path, help="Record timing spans of the whole batch to this directory")
+    args = parser.parse_args()
+    if args.trace_dir:
+        tracer.configure(args.trace_dir, run_id=args.output_dir.name)
+
+    provider = APIProvider.ANTHROPIC
+    model = PROVIDER_TO_DEFAULT_MODEL_NAME[provider]
+    tasks = load_tasks(args.tasks)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    # the display pool doubles as the concurrency limit
+    concurrency = max(1, min(args.concurrency, len(args.displays)))
+    displays: asyncio.Queue[int] = asyncio.Queue()
+    for display_num in args.displays[:concurrency]:
+        displays.put_nowait(display_num)
+
+    started = time.monotonic()
+    records = await asyncio.gather(
+        *(
+            run_task(
+                task,
+                displays,
+                args.output_dir,
+                provider=provider,
+                model=model,
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                only_n_most_recent_images=args.only_n_most_recent_images,
+            )
+            for task in tasks
+        )
+    )
+    await close_clients()
+    tracer.flush()
+    elapsed = time.monotonic() - started
+
+    statuses: dict[str, int] = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    summary = {
+        "tasks": len(records),
+        "statuses": statuses,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "tasks_per_hour": round(len(records) / elapsed * 3600, 2) if elapsed else None,
+        "mean_task_s": round(sum(r["duration_s"] for r in records) / len(records), 3) if records else None,
+        "turns": sum(r["turns"] for r in records),
+        "cache_hit_ratio": _overall_hit_ratio(records),
+        "skipped_screenshots": sum(r["skipped_screenshots"] for r in records),
+        "settle_saved_s": round(sum(r["settle_saved_s"] for r in records), 3),
+        "command_cpu_s": round(sum(r["command_cpu_s"] for r in records), 3),
+        "records": records,
+    }
+    with (args.output_dir / "summary.json").open("w") as f:
+        json.dump(summary, f, indent=2)
+    print(
+        f"{len(records)} tasks in {elapsed:.1f}s ({summary['tasks_per_hour']} tasks/hour) "
+        f"on {concurrency} displays: {statuses}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
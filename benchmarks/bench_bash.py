@@ -0,0 +1,109 @@
+#!/bin/python
+"""
+Benchmark the latency of bash tool commands.
+
+    python benchmarks/bench_bash.py --iterations 20
+
+Runs `echo`, `ls -R` and a 50 MB `cat` through _BashSession, which reads the
+shell's output as it arrives, and through the previous implementation, which
+polled the pipe buffers every 200 ms.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.base import CLIResult, ToolError  # noqa: E402
+from tools.bash import _BashSession  # noqa: E402
+
+CAT_SIZE = 50 << 20
+# the polling session never reads the pipes, so it can't finish large outputs
+POLLING_TIMEOUT = 10.0
+
+
+class PollingSession(_BashSession):
+    """The bash session as it was: sleep, then look for the sentinel in the pipe buffer."""
+
+    _output_delay = 0.2
+    _timeout = POLLING_TIMEOUT
+    # asyncio's default StreamReader limit
+    _read_size = 1 << 16
+
+    async def run(self, command: str):
+        assert self._process.stdin and self._process.stdout and self._process.stderr
+        self._process.stdin.write(command.encode() + f"; echo '{self._sentinel}'\n".encode())
+        await self._process.stdin.drain()
+        async with asyncio.timeout(self._timeout):
+            while True:
+                await asyncio.sleep(self._output_delay)
+                output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
+                if self._sentinel in output:
+                    output = output[: output.index(self._sentinel)]
+                    break
+        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
+        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        return CLIResult(output=output.removesuffix("\n"), error=error.removesuffix("\n"))
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    print(
+        f"{name:<32} p50 {statistics.median(timings) * 1000:8.1f} ms"
+        f"   p95 {timings[int(0.95 * (len(timings) - 1))] * 1000:8.1f} ms"
+    )
+
+
+async def bench(session_class: type[_BashSession], commands: dict[str, str], iterations: int):
+    label = "polling" if session_class is PollingSession else "streaming"
+    session = session_class()
+    await session.start()
+    for name, command in commands.items():
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            try:
+                # _BashSession.run prints every command
+                with contextlib.redirect_stdout(io.StringIO()):
+                    await session.run(command)
+            except (ToolError, TimeoutError):
+                print(f"{label} {name:<22} timed out after {session._timeout:.0f} s")
+                # the shell is stuck on the output nobody reads
+                await session.close()
+                session = session_class()
+                await session.start()
+                break
+            timings.append(time.perf_counter() - start)
+        else:
+            report(f"{label} {name}", timings)
+    await session.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--ls-dir", default="/usr/share", help="directory listed by ls -R")
+    args = parser.parse_args()
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".txt") as big:
+        line = "x" * 79 + "\n"
+        big.write(line * (CAT_SIZE // len(line)))
+        big.flush()
+        commands = {
+            "echo": "echo hello",
+            "ls -R": f"ls -R {args.ls_dir}",
+            "cat 50 MB": f"cat {big.name}",
+        }
+        for session_class in (_BashSession, PollingSession):
+            await bench(session_class, commands, args.iterations)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+#!/bin/python
+"""
+Benchmark screen capture backends, headless under Xvfb.
+
+    python benchmarks/bench_capture.py --start-xvfb --size 1920x1080
+
+Times a full-screen grab plus PNG encode with the in-process X11 backend (with and
+without MIT-SHM) against the gnome-screenshot/scrot subprocess path.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.capture import X11Capture  # noqa: E402
+from tools.imaging import encode_png, frame_to_array  # noqa: E402
+from tools.run import run  # noqa: E402
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    print(
+        f"{name:<28} p50 {statistics.median(timings) * 1000:8.1f} ms"
+        f"   p95 {timings[int(0.95 * (len(timings) - 1))] * 1000:8.1f} ms"
+    )
+
+
+def bench_in_process(display_num: int, iterations: int, use_shm: bool):
+    capture = X11Capture.open(display_num)
+    if capture is None:
+        print(f"cannot open display :{display_num}")
+        return
+    capture._use_shm = use_shm and capture._use_shm
+    grab, encode = [], []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        frame = capture.grab()
+        grabbed = time.perf_counter()
+        encode_png(frame_to_array(frame))
+        grab.append(grabbed - start)
+        encode.append(time.perf_counter() - grabbed)
+    label = "shm" if capture._use_shm else "XGetImage"
+    capture.close()
+    report(f"x11 {label} grab", grab)
+    report(f"x11 {label} grab+encode", [a + b for a, b in zip(grab, encode)])
+
+
+async def bench_subprocess(display_num: int, iterations: int):
+    if shutil.which("gnome-screenshot"):
+        template = "DISPLAY=:{} gnome-screenshot -f {} -p"
+    elif shutil.which("scrot"):
+        template = "DISPLAY=:{} scrot -p {}"
+    else:
+        print("neither gnome-screenshot nor scrot is installed, skipping subprocess path")
+        return
+    timings = []
+    for _ in range(iterations):
+        path = Path("/tmp/outputs") / f"bench_{uuid4().hex}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        await run(template.format(display_num, path))
+        path.read_bytes()
+        timings.append(time.perf_counter() - start)
+        path.unlink(missing_ok=True)
+    report("subprocess grab+read", timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--display", type=int, default=99)
+    parser.add_argument("--start-xvfb", action="store_true", help="start an Xvfb server on --display for the benchmark")
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--iterations", type=int, default=30)
+    args = parser.parse_args()
+
+    xvfb = None
+    if args.start_xvfb:
+        xvfb = subprocess.Popen(["Xvfb", f":{args.display}", "-screen", "0", f"{args.size}x24"])
+        time.sleep(1)
+    os.environ["DISPLAY"] = f":{args.display}"
+    try:
+        bench_in_process(args.display, args.iterations, use_shm=True)
+        bench_in_process(args.display, args.iterations, use_shm=False)
+        asyncio.run(bench_subprocess(args.display, args.iterations))
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/bin/python
+"""
+Benchmark input injection, headless under Xvfb.
+
+    python benchmarks/bench_input.py --start-xvfb
+
+Times pointer moves, clicks, key combinations and typing through the in-process
+XTEST backend against one xdotool process per action.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.run import run  # noqa: E402
+from tools.xinput import XTestInput  # noqa: E402
+
+ACTIONS = {
+    "mouse_move": ("mousemove --sync 200 300", lambda xinput: xinput.move(200, 300)),
+    "left_click": ("click 1", lambda xinput: xinput.click(1)),
+    "key ctrl+a": ("key -- ctrl+a", lambda xinput: xinput.key("ctrl+a", 0.012)),
+    "type 50 chars": (
+        "type --delay 12 -- " + "x" * 50,
+        lambda xinput: xinput.type("x" * 50, 0.012),
+    ),
+}
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    print(
+        f"{name:<32} p50 {statistics.median(timings) * 1000:8.2f} ms"
+        f"   p95 {timings[int(0.95 * (len(timings) - 1))] * 1000:8.2f} ms"
+    )
+
+
+async def bench(display_num: int, iterations: int):
+    xinput = XTestInput.open(display_num)
+    if xinput is None:
+        print(f"cannot open display :{display_num} with XTEST")
+    has_xdotool = shutil.which("xdotool") is not None
+    if not has_xdotool:
+        print("xdotool is not installed, skipping the subprocess path")
+    for name, (xdotool_args, inject) in ACTIONS.items():
+        if xinput is not None:
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await inject(xinput)
+                timings.append(time.perf_counter() - start)
+            report(f"xtest {name}", timings)
+        if has_xdotool:
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await run(f"DISPLAY=:{display_num} xdotool {xdotool_args}")
+                timings.append(time.perf_counter() - start)
+            report(f"xdotool {name}", timings)
+    if xinput is not None:
+        xinput.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--display", type=int, default=99)
+    parser.add_argument("--start-xvfb", action="store_true", help="start an Xvfb server on --display for the benchmark")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    xvfb = None
+    if args.start_xvfb:
+        xvfb = subprocess.Popen(["Xvfb", f":{args.display}", "-screen", "0", "1920x1080x24"])
+        time.sleep(1)
+    os.environ["DISPLAY"] = f":{args.display}"
+    try:
+        asyncio.run(bench(args.display, args.iterations))
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+
+
+if __name__ == "__main__":
+    main()
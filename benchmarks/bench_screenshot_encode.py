@@ -0,0 +1,121 @@
+#!/bin/python
+"""
+Benchmark the screenshot resize + encode pipeline.
+
+    python benchmarks/bench_screenshot_encode.py
+    python benchmarks/bench_screenshot_encode.py --image screen.png --iterations 50
+
+Downscales 1920x1080 and 3840x2160 sources to the FWXGA API target and base64
+encodes the PNG, in memory at several zlib levels and with the previous
+`convert -resize` + read-back path when ImageMagick is installed. Without
+--image the sources are synthetic desktops: flat windows, title bars and text.
+"""
+
+import argparse
+import base64
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.computer import MAX_SCALING_TARGETS  # noqa: E402
+from tools.imaging import encode_png, load_image, resize  # noqa: E402
+
+SOURCES = [(1920, 1080), (3840, 2160)]
+TARGET = MAX_SCALING_TARGETS["FWXGA"]
+
+
+def synthetic_desktop(width: int, height: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    pixels = np.full((height, width, 3), 236, dtype=np.uint8)
+    pixels[: height // 27] = (40, 40, 60)
+    for _ in range(60):
+        w, h = rng.integers(width // 20, width // 6), rng.integers(height // 20, height // 5)
+        x, y = rng.integers(0, width - w), rng.integers(height // 27, height - h)
+        pixels[y : y + h, x : x + w] = rng.integers(0, 256, 3)
+        pixels[y : y + h // 10, x : x + w] = (60, 60, 90)
+    # lines of "text": dark runs of random length
+    glyph = max(1, width // 1920)
+    for _ in range(3000):
+        x, y = rng.integers(0, width - 40 * glyph), rng.integers(height // 27, height - 12 * glyph)
+        run = pixels[y : y + 10 * glyph, x : x + rng.integers(2, 40) * glyph]
+        run[rng.random(run.shape[:2]) < 0.4] = 20
+    return pixels
+
+
+def timed(function, iterations: int) -> tuple[float, float, object]:
+    result = function()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings), timings[int(0.95 * (len(timings) - 1))], result
+
+
+def report(name: str, p50: float, p95: float, size: int | None = None):
+    line = f"  {name:<28} p50 {p50 * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms"
+    if size is not None:
+        line += f"   {size / 1024:7.0f} KB base64"
+    print(line)
+
+
+def bench_source(pixels: np.ndarray, iterations: int):
+    height, width, _ = pixels.shape
+    print(f"{width}x{height} -> {TARGET['width']}x{TARGET['height']}")
+
+    p50, p95, _ = timed(lambda: resize(pixels, TARGET["width"], TARGET["height"]), iterations)
+    report("resize", p50, p95)
+    for level in (1, 3, 6, 9):
+        def pipeline():
+            scaled = resize(pixels, TARGET["width"], TARGET["height"])
+            return base64.b64encode(encode_png(scaled, level))
+
+        p50, p95, encoded = timed(pipeline, iterations)
+        report(f"in-memory, zlib level {level}", p50, p95, len(encoded))
+
+    if shutil.which("convert") is None:
+        print("  convert not found, skipping the ImageMagick path")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "source.png"
+        # the capture command leaves a PNG on disk, not part of the timing
+        source.write_bytes(encode_png(pixels))
+        path = Path(tmp) / "screenshot.png"
+
+        def imagemagick():
+            shutil.copy(source, path)
+            subprocess.run(
+                ["convert", str(path), "-resize", f"{TARGET['width']}x{TARGET['height']}!", str(path)],
+                check=True,
+            )
+            return base64.b64encode(path.read_bytes())
+
+        p50, p95, encoded = timed(imagemagick, iterations)
+        report("convert -resize + read", p50, p95, len(encoded))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", type=Path, help="use this screenshot, scaled to each source size, instead of a synthetic one")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    for width, height in SOURCES:
+        if args.image:
+            pixels = resize(load_image(args.image), width, height)
+        else:
+            pixels = synthetic_desktop(width, height)
+        bench_source(pixels, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/bin/python
+"""
+Benchmark startup: how long until surrender.py is importable, and until its
+first API request leaves the process.
+
+    python benchmarks/bench_startup.py --iterations 10
+
+The API is a local HTTP server answering every request with a short end_turn
+message, so no key or network is needed. Each iteration is a fresh interpreter,
+which is what a user or a batch worker pays for.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+MESSAGE = {
+    "id": "msg_bench",
+    "type": "message",
+    "role": "assistant",
+    "model": "claude-3-5-sonnet-20241022",
+    "content": [{"type": "text", "text": "done"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 1, "output_tokens": 1},
+}
+
+
+class FakeAPI(http.server.BaseHTTPRequestHandler):
+    first_request: float | None = None
+
+    def do_POST(self):
+        if FakeAPI.first_request is None:
+            FakeAPI.first_request = time.perf_counter()
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = json.dumps(MESSAGE).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    print(
+        f"{name:<32} p50 {statistics.median(timings) * 1000:8.1f} ms"
+        f"   p95 {timings[int(0.95 * (len(timings) - 1))] * 1000:8.1f} ms"
+    )
+
+
+def bench_import(iterations: int, env: dict[str, str]):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import surrender"], env=env, check=True)
+        timings.append(time.perf_counter() - start)
+    report("import surrender", timings)
+
+
+def bench_first_request(iterations: int, env: dict[str, str]):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = {
+        **env,
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}",
+        "ANTHROPIC_API_KEY": "bench",
+        # a fixed resolution, as set in production, skips the screen probe
+        "WIDTH": "1280",
+        "HEIGHT": "800",
+        "ASCII_PREVIEW": "0",
+    }
+    timings = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(iterations):
+            FakeAPI.first_request = None
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, str(REPO / "surrender.py"), "hi"],
+                env=env,
+                cwd=cwd,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            if FakeAPI.first_request is None:
+                print("surrender.py exited without calling the API")
+                break
+            timings.append(FakeAPI.first_request - start)
+    server.shutdown()
+    if timings:
+        report("time to first request", timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+    env = {**os.environ, "PYTHONPATH": str(REPO)}
+    bench_import(args.iterations, env)
+    bench_first_request(args.iterations, env)
+
+
+if __name__ == "__main__":
+    main()
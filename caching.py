@@ -0,0 +1,158 @@
+"""
+Prompt cache bookkeeping for the sampling loop.
+
+PromptCacheTracker records the cache usage the API reports for each response and
+uses it to decide where the cache breakpoints go and how many screenshots to drop
+at once, trading the cost of re-writing the cache after each pruning against the
+cost of carrying extra images in every request.
+"""
+
+import math
+
+from anthropic.types.beta import BetaCacheControlEphemeralParam, BetaUsage
+
+from conversation import Conversation
+
+# price of cache writes and reads relative to plain input tokens
+CACHE_WRITE_COST: float = 1.25
+CACHE_READ_COST: float = 0.1
+# bounds of the number of images removed at once when pruning screenshots
+MIN_IMAGE_REMOVAL_CHUNK: int = 1
+MAX_IMAGE_REMOVAL_CHUNK: int = 50
+# weight of the latest turn in the running averages of cache writes
+USAGE_SMOOTHING: float = 0.3
+# breakpoints available for messages, one more is used by the tools/system prompt
+MESSAGE_BREAKPOINTS: int = 3
+
+
+class PromptCacheTracker:
+    """Per-session prompt cache statistics and the breakpoint policy derived from them."""
+
+    def __init__(self):
+        self.turns = 0
+        self.input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.image_removal_chunk = MIN_IMAGE_REMOVAL_CHUNK
+        # running averages of cache writes on turns with and without image pruning
+        self._write_when_pruned: float | None = None
+        self._write_otherwise: float | None = None
+        # position of the long-lived breakpoint placed before the oldest image
+        self._anchor: int | None = None
+
+    def record(self, usage: BetaUsage, images_removed: int, image_tokens: int):
+        """Account for a response and adapt the image removal chunk size."""
+        created = usage.cache_creation_input_tokens or 0
+        self.turns += 1
+        self.input_tokens += usage.input_tokens
+        self.cache_creation_input_tokens += created
+        self.cache_read_input_tokens += usage.cache_read_input_tokens or 0
+
+        if images_removed:
+            self._write_when_pruned = _smooth(self._write_when_pruned, created)
+        else:
+            self._write_otherwise = _smooth(self._write_otherwise, created)
+        if self._write_when_pruned is None or self._write_otherwise is None:
+            return
+
+        # With one new screenshot per turn and a chunk of c, pruning re-writes the
+        # cache once every c turns while we carry (c - 1) / 2 extra images on
+        # average. Minimizing the sum of both costs per turn gives the chunk below.
+        bust = max(0.0, self._write_when_pruned - self._write_otherwise)
+        bust_cost = bust * (CACHE_WRITE_COST - CACHE_READ_COST)
+        carry_cost = max(1, image_tokens) * CACHE_READ_COST / 2
+        chunk = round(math.sqrt(bust_cost / carry_cost))
+        self.image_removal_chunk = max(
+            MIN_IMAGE_REMOVAL_CHUNK, min(MAX_IMAGE_REMOVAL_CHUNK, chunk)
+        )
+
+    def place_breakpoints(self, messages: Conversation, anchor_images: bool):
+        """
+        Set cache breakpoints on the most recent user turns. When `anchor_images`
+        is set, one of them instead marks the last user turn before the oldest
+        screenshot: pruning never changes that prefix, so it keeps being read from
+        the cache across prunings.
+        """
+        anchor = self._find_anchor(messages) if anchor_images else None
+        recent = _recent_user_turns(messages, MESSAGE_BREAKPOINTS + 1)
+        if anchor is not None and anchor in recent[: MESSAGE_BREAKPOINTS - 1]:
+            anchor = None
+        wanted = set(recent[: MESSAGE_BREAKPOINTS - (anchor is not None)])
+        if anchor is not None:
+            wanted.add(anchor)
+
+        stale = set(recent)
+        if self._anchor is not None and self._anchor < len(messages):
+            stale.add(self._anchor)
+        for position in stale - wanted:
+            messages[position]["content"][-1].pop("cache_control", None)
+        for position in wanted:
+            messages[position]["content"][-1]["cache_control"] = (
+                BetaCacheControlEphemeralParam({"type": "ephemeral"})
+            )
+        self._anchor = anchor
+
+    def _find_anchor(self, messages: Conversation) -> int | None:
+        if (position := messages.oldest_image_position) is None:
+            return None
+        for position in range(position - 1, -1, -1):
+            message = messages[position]
+            if message["role"] == "user" and isinstance(message["content"], list):
+                return position if message["content"] else None
+        return None
+
+    @property
+    def hit_ratio(self) -> float:
+        """Share of the input tokens that were read from the cache."""
+        total = (
+            self.input_tokens
+            + self.cache_creation_input_tokens
+            + self.cache_read_input_tokens
+        )
+        return self.cache_read_input_tokens / total if total else 0.0
+
+    @property
+    def relative_cost(self) -> float:
+        """Input cost with caching relative to the same requests without it; below 1 means caching pays."""
+        total = (
+            self.input_tokens
+            + self.cache_creation_input_tokens
+            + self.cache_read_input_tokens
+        )
+        if not total:
+            return 1.0
+        return (
+            self.input_tokens
+            + CACHE_WRITE_COST * self.cache_creation_input_tokens
+            + CACHE_READ_COST * self.cache_read_input_tokens
+        ) / total
+
+    def summary(self) -> dict[str, int | float]:
+        return {
+            "turns": self.turns,
+            "input_tokens": self.input_tokens,
+            "cache_creation_input_tokens": self.cache_creation_input_tokens,
+            "cache_read_input_tokens": self.cache_read_input_tokens,
+            "hit_ratio": round(self.hit_ratio, 3),
+            "relative_cost": round(self.relative_cost, 3),
+            "image_removal_chunk": self.image_removal_chunk,
+        }
+
+
+def _recent_user_turns(messages: Conversation, count: int) -> list[int]:
+    """Positions of the latest `count` user messages with block content, newest first."""
+    positions: list[int] = []
+    for position in range(len(messages) - 1, -1, -1):
+        message = messages[position]
+        if message["role"] == "user" and isinstance(content := message["content"], list):
+            if content:
+                positions.append(position)
+            if len(positions) == count:
+                break
+    return positions
+
+
+def _smooth(average: float | None, value: float) -> float:
+    if average is None:
+        return value
+    return (1 - USAGE_SMOOTHING) * average + USAGE_SMOOTHING * value
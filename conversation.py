@@ -0,0 +1,180 @@
+"""Message history container used by the sampling loop."""
+
+import base64
+import binascii
+import json
+import struct
+from collections import deque
+from collections.abc import Iterable
+from typing import Any
+
+from anthropic.types.beta import (
+    BetaImageBlockParam,
+    BetaMessageParam,
+    BetaTextBlockParam,
+)
+
+# rough token accounting, good enough to enforce a budget
+CHARS_PER_TOKEN: int = 4
+PIXELS_PER_IMAGE_TOKEN: int = 750
+IMAGE_TOKEN_ESTIMATE: int = 1600  # when the image size can't be read
+# once over budget, compact down to this fraction of it so the prompt cache is
+# only invalidated every now and then instead of on every turn
+COMPACTION_LOW_WATER: float = 0.8
+# characters kept from the start of a compacted tool output
+COMPACTED_HEAD_LEN: int = 200
+ELIDED_MESSAGE: str = "<elided {} characters of an old tool output to save context>"
+
+
+class Conversation(list[BetaMessageParam]):
+    """
+    An append-only list of messages that indexes the tool_result images and texts
+    as they are appended, and keeps a running estimate of its size in tokens, so
+    that dropping old screenshots or compacting old outputs only touches the blocks
+    changed instead of rescanning the whole history every turn.
+    """
+
+    # (message position, content list of the tool_result, image block in it), oldest first
+    _images: deque[tuple[int, list[BetaTextBlockParam | BetaImageBlockParam], BetaImageBlockParam]]
+    # (message position, text block of a tool_result), oldest first
+    _tool_texts: deque[tuple[int, BetaTextBlockParam]]
+    # estimated input tokens of the whole history
+    token_estimate: int
+
+    def __init__(self, messages: Iterable[BetaMessageParam] = ()):
+        super().__init__()
+        self._images = deque()
+        self._tool_texts = deque()
+        self.token_estimate = 0
+        self.extend(messages)
+
+    def append(self, message: BetaMessageParam):
+        super().append(message)
+        self.token_estimate += estimate_tokens(message["content"])
+        self._index(message)
+
+    def extend(self, messages: Iterable[BetaMessageParam]):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable[BetaMessageParam]):
+        self.extend(messages)
+        return self
+
+    @property
+    def image_count(self) -> int:
+        return len(self._images)
+
+    @property
+    def oldest_image_position(self) -> int | None:
+        """Position of the oldest message that still holds an image."""
+        return self._images[0][0] if self._images else None
+
+    @property
+    def image_tokens(self) -> int:
+        """Estimated tokens of the latest image."""
+        if not self._images:
+            return IMAGE_TOKEN_ESTIMATE
+        return _estimate_image_tokens(self._images[-1][2])
+
+    def filter_to_n_most_recent_images(
+        self, images_to_keep: int, min_removal_threshold: int
+    ) -> int:
+        """
+        With the assumption that images are screenshots that are of diminishing value as
+        the conversation progresses, remove all but the final `images_to_keep` tool_result
+        images in place, with a chunk of min_removal_threshold to reduce the amount we
+        break the implicit prompt cache. Returns the number of images removed.
+        """
+        images_to_remove = len(self._images) - images_to_keep
+        if images_to_remove <= 0:
+            return 0
+        # for better cache behavior, we want to remove in chunks
+        images_to_remove -= images_to_remove % min_removal_threshold
+
+        for _ in range(images_to_remove):
+            _, content, image = self._images.popleft()
+            for i, block in enumerate(content):
+                if block is image:
+                    del content[i]
+                    self.token_estimate -= estimate_tokens(image)
+                    break
+        return images_to_remove
+
+    def compact(self, max_tokens: int, protect_from: int) -> int:
+        """
+        Shorten the oldest text tool outputs, in place, until the estimated history
+        fits in `max_tokens`. Messages from position `protect_from` on are left alone,
+        as are the blocks themselves so cache_control markers stay where they are.
+        Returns the number of tokens saved.
+        """
+        if self.token_estimate <= max_tokens:
+            return 0
+        target = int(max_tokens * COMPACTION_LOW_WATER)
+        saved = 0
+        while self._tool_texts and self.token_estimate > target:
+            position, block = self._tool_texts[0]
+            if position >= protect_from:
+                break
+            self._tool_texts.popleft()
+            text = block["text"]
+            elided = len(text) - COMPACTED_HEAD_LEN
+            if elided <= len(ELIDED_MESSAGE):
+                continue
+            before = estimate_tokens(block)
+            block["text"] = text[:COMPACTED_HEAD_LEN] + ELIDED_MESSAGE.format(elided)
+            delta = before - estimate_tokens(block)
+            self.token_estimate -= delta
+            saved += delta
+        return saved
+
+    def _index(self, message: BetaMessageParam):
+        if not isinstance(content := message["content"], list):
+            return
+        for item in content:
+            if not (isinstance(item, dict) and item.get("type") == "tool_result"):
+                continue
+            if not isinstance(tool_content := item.get("content"), list):
+                continue
+            for block in tool_content:
+                if not isinstance(block, dict):
+                    continue
+                if block.get("type") == "image":
+                    self._images.append((len(self) - 1, tool_content, block))
+                elif block.get("type") == "text":
+                    self._tool_texts.append((len(self) - 1, block))
+
+
+def estimate_tokens(content: Any) -> int:
+    """Estimate the input tokens of a message content, block or list of blocks."""
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN
+    if isinstance(content, list):
+        return sum(estimate_tokens(block) for block in content)
+    if not isinstance(content, dict):
+        return 0
+    block_type = content.get("type")
+    if block_type == "text":
+        return estimate_tokens(content["text"])
+    if block_type == "image":
+        return _estimate_image_tokens(content)
+    if block_type == "tool_result":
+        return estimate_tokens(content.get("content", ""))
+    if block_type == "tool_use":
+        return estimate_tokens(json.dumps(content.get("input", {}))) + 10
+    return 0
+
+
+def _estimate_image_tokens(image: BetaImageBlockParam) -> int:
+    # the width and height of a PNG sit in its IHDR chunk, within the first 24 bytes
+    source = image.get("source", {})
+    if source.get("media_type") != "image/png":
+        return IMAGE_TOKEN_ESTIMATE
+    try:
+        header = base64.b64decode(source["data"][:32])
+    except (KeyError, binascii.Error):
+        return IMAGE_TOKEN_ESTIMATE
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return IMAGE_TOKEN_ESTIMATE
+    width, height = struct.unpack(">II", header[16:24])
+    return width * height // PIXELS_PER_IMAGE_TOKEN
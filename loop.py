@@ -8,6 +8,9 @@ This module is the heart of the Computer Use Demo system. It:
 4. Maintains conversation history and context
 """
 
+import asyncio
+import json
+import os
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
@@ -15,22 +18,26 @@ from typing import Any, cast
 
 import httpx
 from anthropic import (
-    Anthropic,
-    AnthropicBedrock,
-    AnthropicVertex,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
     APIError,
     APIResponseValidationError,
     APIStatusError,
+    AsyncStream,
+    DefaultAsyncHttpxClient,
 )
 from anthropic.types.beta import (
-    BetaCacheControlEphemeralParam,
+    BetaContentBlock,
     BetaContentBlockParam,
     BetaImageBlockParam,
     BetaMessage,
     BetaMessageParam,
+    BetaRawMessageStreamEvent,
     BetaTextBlock,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
+    BetaToolUseBlock,
     BetaToolUseBlockParam,
 )
 
@@ -39,7 +46,11 @@ from tools.computer import ComputerTool
 from tools.edit import EditTool
 from tools.collection import ToolCollection
 from tools.base import ToolResult
-import time
+from tools.tracing import span
+from caching import PromptCacheTracker
+from conversation import Conversation
+from pacing import get_pacer
+from retry import RetryPolicy, error_request
 
 COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
@@ -63,7 +74,55 @@ PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.VERTEX: "claude-3-5-sonnet-v2@20241022",
 }
 
+# Latest messages never compacted, whether or not they carry a cache breakpoint.
+COMPACTION_KEEP_MESSAGES: int = 6
 
+# Connections kept open to the API, shared by every sampling_loop in the process.
+API_POOL_SIZE: int = int(os.getenv("API_POOL_SIZE", "16"))
+API_KEEPALIVE_EXPIRY: float = 120.0  # seconds
+
+AsyncClient = AsyncAnthropic | AsyncAnthropicBedrock | AsyncAnthropicVertex
+
+_clients: dict[tuple[APIProvider, str | None], AsyncClient] = {}
+
+
+def get_client(
+    provider: APIProvider, api_key: str | None = None, pool_size: int = API_POOL_SIZE
+) -> AsyncClient:
+    """
+    Return the async client for this provider, creating it on first use.
+    Clients are cached for the lifetime of the process so that every loop reuses
+    the same keep-alive connection pool instead of paying a TLS handshake per turn.
+    """
+    key = (provider, api_key)
+    if (client := _clients.get(key)) is not None:
+        return client
+
+    # retries are handled by sampling_loop, see retry.RetryPolicy
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=API_KEEPALIVE_EXPIRY,
+        )
+    )
+    if provider == APIProvider.ANTHROPIC:
+        client = AsyncAnthropic(api_key=api_key, http_client=http_client, max_retries=0)
+    elif provider == APIProvider.VERTEX:
+        client = AsyncAnthropicVertex(http_client=http_client, max_retries=0)
+    elif provider == APIProvider.BEDROCK:
+        client = AsyncAnthropicBedrock(http_client=http_client, max_retries=0)
+    else:
+        raise ValueError(f"Unknown provider {provider}")
+    _clients[key] = client
+    return client
+
+
+async def close_clients():
+    """Close every pooled client, e.g. before the event loop shuts down."""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.close()
 
 
 async def sampling_loop(
@@ -80,184 +139,269 @@ async def sampling_loop(
     api_key: str,                  # API key for authentication
     only_n_most_recent_images: int | None = None,  # Limit number of images in context
     max_tokens: int = 4096,        # Maximum tokens in Claude's response
+    max_input_tokens: int | None = None,  # Shorten old tool outputs beyond this many input tokens
+    stream: bool = False,          # Start tools while the rest of the response streams in
+    tool_collection: ToolCollection | None = None,  # Initialized tools, by default one of each on $DISPLAY_NUM
+    cache_tracker: PromptCacheTracker | None = None,  # Collects prompt cache usage for this session
+    tool_progress_callback: Callable[[str], None] | None = None,  # Output of running commands, for the default tools
 ):
-    computer_tool = ComputerTool(width=None, height=None)
-    await computer_tool.ensure_initialized()
-    tool_collection = ToolCollection(
-        computer_tool,
-        BashTool(),
-        EditTool(),
-    )
+    if tool_collection is None:
+        computer_tool = ComputerTool(width=None, height=None)
+        await computer_tool.ensure_initialized()
+        tool_collection = ToolCollection(
+            computer_tool,
+            BashTool(progress_callback=tool_progress_callback),
+            EditTool(),
+        )
+        # tools we created are ours to close
+        try:
+            return await sampling_loop(
+                model=model,
+                provider=provider,
+                system_prompt=system_prompt,
+                messages=messages,
+                output_callback=output_callback,
+                tool_output_callback=tool_output_callback,
+                api_response_callback=api_response_callback,
+                api_key=api_key,
+                only_n_most_recent_images=only_n_most_recent_images,
+                max_tokens=max_tokens,
+                max_input_tokens=max_input_tokens,
+                stream=stream,
+                tool_collection=tool_collection,
+                cache_tracker=cache_tracker,
+            )
+        finally:
+            await tool_collection.close()
     #tool_collection = ToolCollection(computer_tool,)
     system = BetaTextBlockParam(
         type="text",
         text=f"{system_prompt}",
     )
+    if not isinstance(messages, Conversation):
+        messages = Conversation(messages)
+    if cache_tracker is None:
+        cache_tracker = PromptCacheTracker()
+    client = get_client(provider, api_key)
+    pacer = get_pacer((provider, api_key))
+    enable_prompt_caching = provider == APIProvider.ANTHROPIC
+    retry_policy = RetryPolicy()
+    # the previous request's size is our estimate for the next one
+    expected_input_tokens = 0
 
     while True:
-        enable_prompt_caching = False
         betas = [COMPUTER_USE_BETA_FLAG]
         image_truncation_threshold = 10
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
+        images_removed = 0
 
         if enable_prompt_caching:
             betas.append(PROMPT_CACHING_BETA_FLAG)
-            _inject_prompt_caching(messages)
-            # Is it ever worth it to bust the cache with prompt caching?
-            image_truncation_threshold = 1 # lol? 50 default.
+            # chunk size adapted to the cache writes each pruning causes
+            image_truncation_threshold = cache_tracker.image_removal_chunk
             system["cache_control"] = {"type": "ephemeral"}
 
         if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
-                messages,
+            images_removed = messages.filter_to_n_most_recent_images(
                 only_n_most_recent_images,
                 min_removal_threshold=image_truncation_threshold,
             )
 
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
+        if enable_prompt_caching:
+            cache_tracker.place_breakpoints(
+                messages, anchor_images=bool(only_n_most_recent_images)
             )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            return messages
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            return messages
-
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
 
-        response = raw_response.parse()
-
-        response_params = _response_to_params(response)
-        messages.append(
-            {
-                "role": "assistant",
-                "content": response_params,
-            }
-        )
+        if max_input_tokens:
+            messages.compact(
+                max_input_tokens, protect_from=_compaction_boundary(messages)
+            )
 
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in response_params:
+        # Call the API
+        # we use raw_response to provide debug information to streamlit. Your
+        # implementation may be able call the SDK directly with:
+        # `response = await client.messages.create(...)` instead.
+        tool_runs: dict[str, asyncio.Task[ToolResult]] = {}
+        # complete blocks of the response, in order, as they arrive
+        completed_blocks: list[BetaTextBlockParam | BetaToolUseBlockParam] = []
+
+        def dispatch(content_block: BetaTextBlockParam | BetaToolUseBlockParam):
+            """Show a finished block and hand its tool call to the scheduler."""
+            completed_blocks.append(content_block)
             output_callback(content_block)
             if content_block["type"] == "tool_use":
-                result = await tool_collection.run(
+                tool_runs[content_block["id"]] = tool_collection.submit(
                     name=content_block["name"],
                     tool_input=cast(dict[str, Any], content_block["input"]),
                 )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block["id"])
+
+        with span("api.pacing"):
+            await pacer.acquire(expected_input_tokens)
+        try:
+            with span("api.call", model=model, stream=stream):
+                raw_response = await client.beta.messages.with_raw_response.create(
+                    max_tokens=max_tokens,
+                    messages=messages,
+                    model=model,
+                    system=[system],
+                    tools=tool_collection.to_params(),
+                    betas=betas,
+                    stream=stream,
                 )
-                tool_output_callback(result, content_block["id"])
+                pacer.update(raw_response.http_response.headers)
+                api_response_callback(
+                    raw_response.http_response.request, raw_response.http_response, None
+                )
+                if stream:
+                    response = await _consume_stream(raw_response.parse(), dispatch)
+                else:
+                    response = raw_response.parse()
+                    for content_block in _response_to_params(response):
+                        dispatch(content_block)
+        except (APIError, httpx.TransportError) as e:
+            if isinstance(e, APIStatusError | APIResponseValidationError):
+                pacer.update(e.response.headers)
+                api_response_callback(e.request, e.response, e)
+            elif isinstance(e, APIError):
+                api_response_callback(e.request, e.body, e)
+            else:
+                api_response_callback(error_request(e), None, e)
+            # tools a broken stream already started are kept with their results,
+            # so that neither a retry nor a later resume runs them again
+            if tool_runs:
+                await _append_turn(
+                    messages, completed_blocks, tool_runs, tool_output_callback
+                )
+            if (delay := retry_policy.next_delay(e)) is None:
+                # messages end on a user turn and can be passed back in to resume
+                return messages
+            await asyncio.sleep(delay)
+            continue
+
+        retry_policy.succeeded()
+        cache_tracker.record(response.usage, images_removed, messages.image_tokens)
+        expected_input_tokens = (
+            response.usage.input_tokens
+            + (response.usage.cache_creation_input_tokens or 0)
+        )
 
         # exit loop if the llm doesn't ask for tool use
-        if not tool_result_content:
+        if not await _append_turn(
+            messages, _response_to_params(response), tool_runs, tool_output_callback
+        ):
             return messages
-        messages.append({"content": tool_result_content, "role": "user"})
         # input("-- press enter to continue --") # safety
-        time.sleep(0.2)
 
 
-def _maybe_filter_to_n_most_recent_images(
+async def _append_turn(
     messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int,
-):
+    response_params: list[BetaTextBlockParam | BetaToolUseBlockParam],
+    tool_runs: dict[str, asyncio.Task[ToolResult]],
+    tool_output_callback: Callable[[ToolResult, str], None],
+) -> bool:
     """
-    With the assumption that images are screenshots that are of diminishing value as
-    the conversation progresses, remove all but the final `images_to_keep` tool_result
-    images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
+    Append the assistant turn and, once its tool calls are done, the user turn
+    holding their results. Returns whether there were any tool results.
     """
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[BetaToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
-            )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
+    messages.append(
+        {
+            "role": "assistant",
+            "content": response_params,
+        }
     )
 
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
+    tool_result_content: list[BetaToolResultBlockParam] = []
+    for content_block in response_params:
+        if content_block["type"] == "tool_use":
+            result = await tool_runs[content_block["id"]]
+            tool_result_content.append(
+                _make_api_tool_result(result, content_block["id"])
+            )
+            tool_output_callback(result, content_block["id"])
+
+    if not tool_result_content:
+        return False
+    messages.append({"content": tool_result_content, "role": "user"})
+    return True
 
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
 
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+async def _consume_stream(
+    stream: AsyncStream[BetaRawMessageStreamEvent],
+    on_block: Callable[[BetaTextBlockParam | BetaToolUseBlockParam], None],
+) -> BetaMessage:
+    """
+    Accumulate a streamed response into a BetaMessage, handing every content block
+    to `on_block` as soon as it is complete so that tool calls can start while the
+    model is still generating the blocks that follow.
+    """
+    message: BetaMessage | None = None
+    partial_json: dict[int, str] = {}
+    async for event in stream:
+        if event.type == "message_start":
+            message = event.message
+        elif event.type == "content_block_start":
+            assert message is not None
+            message.content.append(event.content_block)
+            if event.content_block.type == "tool_use":
+                partial_json[event.index] = ""
+        elif event.type == "content_block_delta":
+            assert message is not None
+            block = message.content[event.index]
+            if event.delta.type == "text_delta":
+                cast(BetaTextBlock, block).text += event.delta.text
+            elif event.delta.type == "input_json_delta":
+                partial_json[event.index] += event.delta.partial_json
+        elif event.type == "content_block_stop":
+            assert message is not None
+            block = message.content[event.index]
+            if event.index in partial_json:
+                cast(BetaToolUseBlock, block).input = json.loads(
+                    partial_json.pop(event.index) or "{}"
+                )
+            on_block(_block_to_param(block))
+        elif event.type == "message_delta":
+            assert message is not None
+            message.stop_reason = event.delta.stop_reason
+            message.usage.output_tokens = event.usage.output_tokens
+    if message is None:
+        raise APIResponseValidationError(
+            response=stream.response,
+            body=None,
+            message="Stream ended before the message started",
+        )
+    return message
+
+
+def _block_to_param(
+    block: BetaContentBlock,
+) -> BetaTextBlockParam | BetaToolUseBlockParam:
+    if isinstance(block, BetaTextBlock):
+        return {"type": "text", "text": block.text}
+    return cast(BetaToolUseBlockParam, block.model_dump())
 
 
 def _response_to_params(
     response: BetaMessage,
 ) -> list[BetaTextBlockParam | BetaToolUseBlockParam]:
-    res: list[BetaTextBlockParam | BetaToolUseBlockParam] = []
-    for block in response.content:
-        if isinstance(block, BetaTextBlock):
-            res.append({"type": "text", "text": block.text})
-        else:
-            res.append(cast(BetaToolUseBlockParam, block.model_dump()))
-    return res
+    return [_block_to_param(block) for block in response.content]
 
 
-def _inject_prompt_caching(
-    messages: list[BetaMessageParam],
-):
+def _compaction_boundary(messages: list[BetaMessageParam]) -> int:
     """
-    Set cache breakpoints for the 3 most recent turns
-    one cache breakpoint is left for tools/system prompt, to be shared across sessions
+    Position of the first message compaction must leave alone: the latest turns,
+    and the recent turns holding a cache breakpoint so that the cached prefixes set
+    by PromptCacheTracker.place_breakpoints keep matching.
     """
-
-    breakpoints_remaining = 3
-    for message in reversed(messages):
-        if message["role"] == "user" and isinstance(
+    boundary = max(0, len(messages) - COMPACTION_KEEP_MESSAGES)
+    for position in range(len(messages) - 1, -1, -1):
+        message = messages[position]
+        if message["role"] != "user" or not isinstance(
             content := message["content"], list
         ):
-            if breakpoints_remaining:
-                breakpoints_remaining -= 1
-                content[-1]["cache_control"] = BetaCacheControlEphemeralParam(
-                    {"type": "ephemeral"}
-                )
-            else:
-                content[-1].pop("cache_control", None)
-                # we'll only every have one extra turn per loop
-                break
+            continue
+        if not content or "cache_control" not in content[-1]:
+            break
+        boundary = min(boundary, position)
+    return boundary
 
 
 def _make_api_tool_result(
@@ -0,0 +1,138 @@
+"""
+Client-side pacing of API requests.
+
+The API reports the state of our rate limits on every response through the
+`anthropic-ratelimit-*` headers, and asks us to back off with `retry-after` when
+we went over. RateLimitPacer mirrors those limits in two token buckets, one for
+requests and one for input tokens, and makes callers wait just long enough for
+the next request to fit. Every loop talking to the API with the same credentials
+shares one pacer, so many concurrent sessions stay under the organisation limits
+together.
+"""
+
+import asyncio
+import time
+from collections.abc import Hashable, Mapping
+from datetime import datetime
+
+# Fraction of the advertised limits we allow ourselves to use.
+RATE_LIMIT_HEADROOM: float = 0.95
+# Anthropic rate limits are expressed per minute.
+RATE_LIMIT_WINDOW: float = 60.0  # seconds
+
+
+class TokenBucket:
+    """A bucket of `capacity` tokens refilled continuously at `refill_rate` tokens per second."""
+
+    def __init__(self, capacity: float = float("inf"), refill_rate: float = float("inf")):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.level = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        if self.level < self.capacity and elapsed > 0:
+            self.level = min(self.capacity, self.level + elapsed * self.refill_rate)
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds to wait until `amount` tokens are available."""
+        self._refill(now)
+        # a request bigger than the whole bucket can only wait for a full one
+        missing = min(amount, self.capacity) - self.level
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: float, remaining: float, now: float):
+        """Align the bucket with the limit and remaining budget reported by the server."""
+        self.capacity = limit * RATE_LIMIT_HEADROOM
+        self.refill_rate = self.capacity / RATE_LIMIT_WINDOW
+        self.level = min(self.capacity, remaining - limit * (1 - RATE_LIMIT_HEADROOM))
+        self._updated_at = now
+
+
+class RateLimitPacer:
+    """Delays requests so they stay under the rate limits reported by the API."""
+
+    def __init__(self):
+        self.requests = TokenBucket()
+        self.input_tokens = TokenBucket()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, input_tokens: int = 0):
+        """Wait until a request of about `input_tokens` input tokens fits, then account for it."""
+        # the lock makes concurrent loops queue up instead of all waking at once
+        async with self._lock:
+            while (delay := self._delay(input_tokens)) > 0:
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            self.requests.take(1, now)
+            self.input_tokens.take(input_tokens, now)
+
+    def _delay(self, input_tokens: int) -> float:
+        now = time.monotonic()
+        return max(
+            self._blocked_until - now,
+            self.requests.delay(1, now),
+            self.input_tokens.delay(input_tokens, now),
+        )
+
+    def update(self, headers: Mapping[str, str]):
+        """Update the buckets from the headers of an API response (successful or not)."""
+        now = time.monotonic()
+        if (retry_after := _parse_float(headers.get("retry-after"))) is not None:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+        _sync_bucket(self.requests, headers, "requests", now)
+        # older API versions only report the combined token limit
+        if not _sync_bucket(self.input_tokens, headers, "input-tokens", now):
+            _sync_bucket(self.input_tokens, headers, "tokens", now)
+
+
+def _sync_bucket(
+    bucket: TokenBucket, headers: Mapping[str, str], name: str, now: float
+) -> bool:
+    limit = _parse_float(headers.get(f"anthropic-ratelimit-{name}-limit"))
+    remaining = _parse_float(headers.get(f"anthropic-ratelimit-{name}-remaining"))
+    if limit is None or remaining is None or limit <= 0:
+        return False
+    bucket.sync(limit, remaining, now)
+    # when the server tells us how long until the bucket is full again, trust it
+    # over our per-minute estimate if it is slower
+    if (reset := headers.get(f"anthropic-ratelimit-{name}-reset")) is not None:
+        try:
+            reset_in = (
+                datetime.fromisoformat(reset) - datetime.now().astimezone()
+            ).total_seconds()
+        except ValueError:
+            reset_in = 0.0
+        if reset_in > 0 and bucket.level < bucket.capacity:
+            bucket.refill_rate = min(
+                bucket.refill_rate, (bucket.capacity - bucket.level) / reset_in
+            )
+    return True
+
+
+def _parse_float(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+_pacers: dict[Hashable, RateLimitPacer] = {}
+
+
+def get_pacer(key: Hashable) -> RateLimitPacer:
+    """Return the pacer shared by every request made with the same credentials."""
+    if (pacer := _pacers.get(key)) is None:
+        pacer = _pacers[key] = RateLimitPacer()
+    return pacer
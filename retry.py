@@ -0,0 +1,106 @@
+"""
+Retrying of transient API failures.
+
+An overloaded API (529), a 5xx, a 429 or a dropped connection should not end a
+long desktop session. RetryPolicy decides whether an error is worth retrying and
+how long to wait: `retry-after` when the server gives one, jittered exponential
+backoff otherwise. Each session has its own retry budget, and all sessions draw
+from a process-wide budget as well, so an outage doesn't turn into a retry storm.
+"""
+
+import random
+import time
+
+import httpx
+from anthropic import (
+    APIConnectionError,
+    APIError,
+    APIStatusError,
+    InternalServerError,
+    RateLimitError,
+)
+
+from pacing import TokenBucket
+
+RETRY_BASE_DELAY: float = 1.0  # seconds
+RETRY_MAX_DELAY: float = 60.0  # seconds
+# retries a single session may spend
+SESSION_RETRY_BUDGET: int = 10
+# retries all sessions of the process may spend, refilled over RETRY_BUDGET_WINDOW
+PROCESS_RETRY_BUDGET: int = 100
+RETRY_BUDGET_WINDOW: float = 600.0  # seconds
+
+# error types of the error events that can end a stream
+RETRYABLE_STREAM_ERRORS = {"overloaded_error", "api_error"}
+
+_process_budget = TokenBucket(
+    PROCESS_RETRY_BUDGET, PROCESS_RETRY_BUDGET / RETRY_BUDGET_WINDOW
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error from the API call is transient."""
+    if isinstance(error, RateLimitError | InternalServerError | APIConnectionError):
+        return True
+    if isinstance(error, httpx.TransportError):
+        # a connection dropped while reading the stream
+        return True
+    if isinstance(error, APIStatusError):
+        if error.status_code in (408, 409):
+            return True
+        # errors sent as events in the middle of a stream come with the stream's 200
+        body = error.body if isinstance(error.body, dict) else {}
+        details = body.get("error", body)
+        return isinstance(details, dict) and details.get("type") in RETRYABLE_STREAM_ERRORS
+    return False
+
+
+class RetryPolicy:
+    """Retry decisions for one session."""
+
+    def __init__(self, budget: int = SESSION_RETRY_BUDGET):
+        self.budget = budget
+        self.retries = 0
+        self._attempt = 0
+
+    def next_delay(self, error: Exception) -> float | None:
+        """
+        Seconds to wait before retrying after `error`, spending one retry from the
+        session and process budgets, or None when the error should not be retried.
+        """
+        if not is_retryable(error) or self.retries >= self.budget:
+            return None
+        now = time.monotonic()
+        if _process_budget.delay(1, now) > 0:
+            return None
+        _process_budget.take(1, now)
+        self.retries += 1
+        self._attempt += 1
+
+        if (retry_after := _retry_after(error)) is not None:
+            return retry_after
+        # "full jitter": spreads retries of concurrent sessions apart
+        return random.uniform(
+            0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (self._attempt - 1))
+        )
+
+    def succeeded(self):
+        """Reset the backoff after a successful call; the budget is not refunded."""
+        self._attempt = 0
+
+
+def _retry_after(error: Exception) -> float | None:
+    if not isinstance(error, APIStatusError):
+        return None
+    try:
+        return float(error.response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def error_request(error: APIError | httpx.TransportError) -> httpx.Request | None:
+    try:
+        return error.request
+    except RuntimeError:
+        # httpx errors raised outside a request have none
+        return None
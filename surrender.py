@@ -20,9 +20,11 @@ from anthropic.types.beta import (
     BetaContentBlockParam,
     BetaTextBlockParam,
 )
+from caching import PromptCacheTracker
 from loop import (
     PROVIDER_TO_DEFAULT_MODEL_NAME,
     APIProvider,
+    close_clients,
     sampling_loop,
 )
 
@@ -32,6 +34,7 @@ from tools.computer import ComputerTool
 from tools.edit import EditTool
 from tools.collection import ToolCollection
 from tools.base import ToolResult
+from tools.tracing import tracer
 
 from dotenv import load_dotenv
 
@@ -39,8 +42,10 @@ SYSTEM_PROMPT = f"""
 <SYSTEM_CAPABILITY>
 * You are are in control of a machine using {platform.machine()} architecture and running {platform.freedesktop_os_release()['NAME']}. Please don't delete anything unless asked three times.
 * To launch a program, use nohup. For example to run firefox, use your bash tool with the command nohup firefox. Do not use '&' with the bash tool to run a command in the background.
+* For a long command like a build or a server, call the bash tool with "background": true as well as the command: it answers at once with a job id, and calling it with "job_id" gives the job's new output and whether it is still running. Jobs start in a fresh shell, so cd in the command itself. Give "session" a name to run commands in another shell, with its own working directory and variables.
 * When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
 * When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
+* To read small text or check details, the computer tool also accepts the action "zoom" with a "region" [x0, y0, x1, y1] in screenshot coordinates: it returns that part of the screen at full resolution. Keep using full screenshot coordinates for clicks afterwards.
 </SYSTEM_CAPABILITY>
 
 <IMPORTANT>
@@ -77,17 +82,34 @@ async def main():
 
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Run the surrender assistant')
-    parser.add_argument('prompt', help='The initial prompt for the assistant')
+    parser.add_argument('prompt', nargs='?', help='The initial prompt for the assistant')
+    parser.add_argument('--resume', help='Continue a conversation saved in debug/ after it stopped on an API error')
+    parser.add_argument('--stream', action='store_true', help='Stream responses and start tools as soon as each call is complete')
+    parser.add_argument('--trace-dir', help='Record timing spans to this directory (see trace_stats.py)')
+    parser.add_argument('--max-input-tokens', type=int, default=None, help='Shorten old tool outputs to keep the context under this many tokens')
+    parser.add_argument('--live-output', action='store_true', help='Print the output of bash commands while they run')
     args = parser.parse_args()
     first_message = args.prompt
+    if args.trace_dir:
+        tracer.configure(args.trace_dir)
+
+    messages = []
+    if args.resume:
+        # tools that already ran have their results saved, they won't run again
+        with open(args.resume) as f:
+            messages = json.load(f)
+        if not first_message and messages and messages[-1]["role"] != Sender.USER:
+            parser.error(f"{args.resume} ended normally, give a prompt to continue it")
+    elif not first_message:
+        parser.error("a prompt is required unless --resume is given")
+    if first_message:
+        text = BetaTextBlockParam(type="text", text=first_message)
+        if messages and messages[-1]["role"] == Sender.USER:
+            messages[-1]["content"].append(text)
+        else:
+            messages.append({"role": Sender.USER, "content": [text]})
 
-    messages = [
-        {
-            "role": Sender.USER,
-            "content": [BetaTextBlockParam(type="text", text=first_message)],
-        }
-    ]
-
+    cache_tracker = PromptCacheTracker()
     messages = await sampling_loop(
         system_prompt=SYSTEM_PROMPT,
         model=model,
@@ -103,10 +125,18 @@ async def main():
         ),
         api_key=api_key,
         only_n_most_recent_images=only_n_most_recent_images,
+        stream=args.stream,
+        max_input_tokens=args.max_input_tokens,
+        cache_tracker=cache_tracker,
+        tool_progress_callback=_render_progress if args.live_output else None,
     )
+    await close_clients()
+    tracer.flush()
+    print(f"Prompt cache: {cache_tracker.summary()}")
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = f"debug/conversation_{timestamp}.json"
+    os.makedirs("debug", exist_ok=True)
     
     print(f"Saving {len(messages)} messages to {output_file}")
     with open(output_file, 'w') as f:
@@ -136,6 +166,11 @@ def _tool_output_callback(
     _render_message(Sender.TOOL, tool_output)
 
 
+def _render_progress(text: str):
+    """Print the output of a running command as it comes."""
+    print(text, end="", flush=True)
+
+
 def _render_api_response(
     request: httpx.Request,
     response: httpx.Response | object | None,
@@ -0,0 +1,122 @@
+"""
+Background writing of debug artifacts.
+
+ArtifactWriter takes files to write without blocking the caller: they go into a
+bounded queue drained by one background task, which writes them from a worker
+thread. When the queue is full the oldest pending file is dropped, so a slow disk
+never holds up the agent. The writer also enforces retention limits, deleting the
+oldest artifacts once there are more than `max_files` or `max_bytes` of them.
+"""
+
+import asyncio
+import os
+from collections import deque
+from collections.abc import Callable
+from pathlib import Path
+
+ARTIFACT_QUEUE_SIZE = 32
+ARTIFACT_MAX_FILES: int | None = 1000
+ARTIFACT_MAX_BYTES: int | None = 1 << 30  # 1 GiB
+
+# the data of a file, or a function computing it in the worker thread
+ArtifactData = bytes | Callable[[], bytes]
+
+
+class ArtifactWriter:
+    """Writes files under one directory in the background."""
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str = "",
+        queue_size: int = ARTIFACT_QUEUE_SIZE,
+        max_files: int | None = ARTIFACT_MAX_FILES,
+        max_bytes: int | None = ARTIFACT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._pending: deque[tuple[str, ArtifactData]] = deque(maxlen=queue_size)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        # every artifact on disk, oldest first, with its size
+        self._files: dict[str, int] = {}
+        self._bytes = 0
+        # the directory is created and scanned before the first write, in the
+        # worker thread, so that a writer costs nothing until it's used
+        self._scanned = False
+
+    def path(self, name: str) -> Path:
+        return self.directory / name
+
+    def submit(self, name: str, data: ArtifactData) -> Path:
+        """Queue a file for writing and return its future path. Never blocks."""
+        if self._closed:
+            self.dropped += 1
+            return self.path(name)
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        # a full deque drops its oldest entry
+        self._pending.append((name, data))
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self.path(name)
+
+    async def close(self):
+        """Write what is still queued and stop the background task."""
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                name, data = self._pending.popleft()
+                await asyncio.to_thread(self._write, name, data)
+            if self._closed:
+                return
+
+    def _scan(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # files of earlier runs count towards the limits too
+        for path in sorted(
+            self.directory.glob(f"{self.prefix}*"), key=lambda path: path.stat().st_mtime
+        ):
+            if path.is_file():
+                self._add(path.name, path.stat().st_size)
+        self._scanned = True
+
+    def _write(self, name: str, data: ArtifactData):
+        if not self._scanned:
+            self._scan()
+        if callable(data):
+            data = data()
+        self.path(name).write_bytes(data)
+        self._add(name, len(data))
+        self._enforce_retention()
+
+    def _add(self, name: str, size: int):
+        # a rewritten file moves to the end, as the newest
+        self._bytes -= self._files.pop(name, 0)
+        self._files[name] = size
+        self._bytes += size
+
+    def _enforce_retention(self):
+        while self._files and (
+            (self.max_files is not None and len(self._files) > self.max_files)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            name = next(iter(self._files))
+            self._bytes -= self._files.pop(name)
+            try:
+                os.unlink(self.path(name))
+            except FileNotFoundError:
+                pass
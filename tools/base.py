@@ -19,6 +19,17 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def resource_keys(self, **kwargs) -> tuple[str, ...]:
+        """
+        Names of the shared state a call with these arguments touches.
+        Calls that share a key run in the order they were submitted, everything
+        else may run concurrently. By default all calls to a tool are serialized.
+        """
+        return (self.to_params()["name"],)
+
+    async def close(self):
+        """Release what the tool holds, e.g. processes or connections, once the session is over."""
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -28,9 +39,15 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    # measurements about the call, for logs and traces; never sent to the API
+    metadata: dict[str, Any] | None = None
 
     def __bool__(self):
-        return any(getattr(self, field.name) for field in fields(self))
+        return any(
+            getattr(self, field.name)
+            for field in fields(self)
+            if field.name != "metadata"
+        )
 
     def __add__(self, other: "ToolResult"):
         def combine_fields(
@@ -47,6 +64,7 @@ class ToolResult:
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            metadata={**(self.metadata or {}), **(other.metadata or {})} or None,
         )
 
     def replace(self, **kwargs):
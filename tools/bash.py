@@ -1,10 +1,25 @@
 import asyncio
+import codecs
+import contextlib
+import itertools
 import os
+import signal
+from collections.abc import Callable
 from typing import ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .output import OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES, HeadTailBuffer
+from .run import command_slot, limit_resources, resource_limits
+from .tracing import span
+
+# called with the output of a running command, as it arrives
+ProgressCallback = Callable[[str], None]
+
+# rlimits of the shells and background jobs, none unless set: they start GUI
+# programs, which reserve a lot of address space and run for hours
+BASH_LIMITS: dict[int, int] = resource_limits("BASH")
 
 
 class _BashSession:
@@ -14,38 +29,56 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "/bin/bash"
-    _output_delay: float = 0.2  # seconds
     _timeout: float = 120.0  # seconds
+    # how long close() waits for the killed shell's pipes to close
+    _close_timeout: float = 5.0  # seconds
     _sentinel: str = "<<exit>>"
+    # most bytes taken from a pipe per read
+    _read_size: int = 1 << 20
+    # bytes kept from the start and the end of a command's stdout and stderr each,
+    # a longer output is spilled to a file
+    _output_head: int = OUTPUT_HEAD_BYTES
+    _output_tail: int = OUTPUT_TAIL_BYTES
 
-    def __init__(self):
+    def __init__(
+        self,
+        env: dict[str, str] | None = None,
+        progress_callback: ProgressCallback | None = None,
+    ):
         self._started = False
         self._timed_out = False
+        self._env = env
+        self._progress_callback = progress_callback
+        # bytes read but not yet part of an output: the start of a possible
+        # sentinel, or what came after the last one
+        self._stdout = bytearray()
+        self._stderr = bytearray()
 
     async def start(self):
         #print("started a bash session", self.command)
         if self._started:
             return
 
+        # exec, so that the process is bash itself and its /proc files are the shell's
         self._process = await asyncio.create_subprocess_shell(
-            self.command,
-            preexec_fn=os.setsid,
+            f"exec {self.command}",
+            preexec_fn=limit_resources(BASH_LIMITS, new_session=True),
             shell=True,
             bufsize=0,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            env=self._env,
+            limit=self._read_size,
         )
 
         self._started = True
 
-    def stop(self):
-        """Terminate the bash shell."""
+    async def close(self):
+        """Kill the shell and whatever it started, and wait for them to exit."""
         if not self._started:
-            raise ToolError("Session has not started.")
-        if self._process.returncode is not None:
             return
-        self._process.terminate()
+        await _kill_process_group(self._process, self._close_timeout)
 
     async def run(self, command: str):
         """Execute a command in the bash shell."""
@@ -62,85 +95,319 @@ class _BashSession:
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             )
 
+        async with command_slot():
+            return await self._run(command)
+
+    async def _run(self, command: str) -> ToolResult:
         # we know these are not None because we created the process with PIPEs
         assert self._process.stdin
         assert self._process.stdout
         assert self._process.stderr
 
-        # send command to the process
-        self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
-        )
-        await self._process.stdin.drain()
+        usage_before = _shell_usage(self._process.pid)
+
+        # send command to the process; the sentinel goes to both pipes, so that
+        # all of stderr is in too once it's found
+        with span("bash.write"):
+            self._process.stdin.write(
+                command.encode()
+                + f"; echo '{self._sentinel}'; echo '{self._sentinel}' >&2\n".encode()
+            )
+            await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        # read output from the process as it comes, until the sentinels are found
+        output = HeadTailBuffer(self._output_head, self._output_tail, spill_name="bash-stdout")
+        error = HeadTailBuffer(self._output_head, self._output_tail, spill_name="bash-stderr")
         try:
-            async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+            with output, error, span("bash.wait"):
+                async with asyncio.timeout(self._timeout):
+                    completed = await asyncio.gather(
+                        self._read_until_sentinel(self._process.stdout, self._stdout, output),
+                        self._read_until_sentinel(self._process.stderr, self._stderr, error),
+                    )
         except asyncio.TimeoutError:
             self._timed_out = True
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
+        if not all(completed):
+            # e.g. the command was `exit`
+            await self._process.wait()
+            return ToolResult(
+                system="tool must be restarted",
+                error=f"bash has exited with returncode {self._process.returncode}",
+            )
+
+        usage_after = _shell_usage(self._process.pid)
+        with span("bash.decode", output_bytes=output.total):
+            return CLIResult(
+                output=output.text().removesuffix("\n"),
+                error=error.text().removesuffix("\n"),
+                metadata={
+                    key: round(value - usage_before[key], 3)
+                    for key, value in usage_after.items()
+                    if key in usage_before
+                }
+                or None,
+            )
+
+    async def _read_until_sentinel(
+        self, stream: asyncio.StreamReader, pending: bytearray, output: HeadTailBuffer
+    ) -> bool:
+        """
+        Move what `stream` prints into `output` until a sentinel line, passing it
+        on to the progress callback too. Returns False if bash exits first.
+        """
+        sentinel = f"{self._sentinel}\n".encode()
+        # bytes held back in case they are the start of a sentinel
+        keep = len(sentinel) - 1
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while (end := pending.find(sentinel)) == -1:
+            if len(pending) > keep:
+                self._write_output(pending[:-keep], output, decoder)
+                del pending[:-keep]
+            if not (chunk := await stream.read(self._read_size)):
+                return False
+            pending += chunk
+        self._write_output(pending[:end], output, decoder, final=True)
+        del pending[: end + len(sentinel)]
+        return True
+
+    def _write_output(
+        self, data: bytes | bytearray, output: HeadTailBuffer, decoder, final=False
+    ):
+        output.write(data)
+        if self._progress_callback is not None:
+            if text := decoder.decode(data, final):
+                self._progress_callback(text)
+
+
+class _BackgroundJob:
+    """A command running in a shell of its own while the agent goes on."""
+
+    _process: asyncio.subprocess.Process
+    _reader: asyncio.Task
+
+    _read_size: int = 1 << 16
+    _close_timeout: float = 5.0  # seconds
+
+    def __init__(self, job_id: int, command: str, env: dict[str, str] | None = None):
+        self.job_id = job_id
+        self.command = command
+        self._env = env
+        # output since the last poll, stdout and stderr interleaved
+        self._output = self._new_output()
+
+    def _new_output(self) -> HeadTailBuffer:
+        return HeadTailBuffer(spill_name=f"bash-job-{self.job_id}")
+
+    async def start(self):
+        self._process = await asyncio.create_subprocess_shell(
+            self.command,
+            preexec_fn=limit_resources(BASH_LIMITS, new_session=True),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=self._env,
+        )
+        self._reader = asyncio.create_task(self._read())
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    async def _read(self):
+        assert self._process.stdout
+        while chunk := await self._process.stdout.read(self._read_size):
+            self._output.write(chunk)
+        await self._process.wait()
 
-        if output.endswith("\n"):
-            output = output[:-1]
-        #print(output)
-        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-        if error.endswith("\n"):
-            error = error[:-1]
+    def poll(self) -> CLIResult:
+        """The output since the last poll, and whether the job is still running."""
+        with self._output as output:
+            self._output = self._new_output()
+        if self._reader.done():
+            status = f"job {self.job_id} has exited with returncode {self._process.returncode}"
+        else:
+            status = f"job {self.job_id} is still running"
+        return CLIResult(output=output.text() or "(no new output)", system=status)
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+    async def close(self):
+        # communicate() below reads what's left, a stream takes one reader at a time
+        self._reader.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._reader
+        await _kill_process_group(self._process, self._close_timeout)
+        self._output.close()
 
-        return CLIResult(output=output, error=error)
+
+async def _kill_process_group(process: asyncio.subprocess.Process, timeout: float):
+    """
+    Kill a process started with os.setsid and everything in its group, then wait
+    for it. Something that left the group may keep the pipes open, so only wait
+    up to `timeout` seconds.
+    """
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGKILL)
+    # reading the pipes to their end also resumes a reader paused on a full buffer
+    with contextlib.suppress(asyncio.TimeoutError):
+        async with asyncio.timeout(timeout):
+            await process.communicate()
 
 
 class BashTool(BaseAnthropicTool):
     """
     A tool that allows the agent to run bash commands.
     The tool parameters are defined by Anthropic and are not editable.
+
+    Beyond them, a call may name a `session`, each name getting a shell of its
+    own, start a command as a `background` job, which returns a job id at once,
+    and poll a job with `job_id` for its new output. Restarts take a shell from
+    a small pool of already started ones.
     """
 
-    _session: _BashSession | None
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
-        self._session = None
+    default_session: ClassVar[str] = "default"
+    # shells started ahead of time for new sessions and restarts
+    _pool_size: int = 1
+
+    def __init__(
+        self,
+        env: dict[str, str] | None = None,
+        progress_callback: ProgressCallback | None = None,
+    ):
+        self._sessions: dict[str, _BashSession] = {}
+        self._pool: list[_BashSession] = []
+        self._pool_task: asyncio.Task | None = None
+        self._jobs: dict[int, _BackgroundJob] = {}
+        self._job_ids = itertools.count(1)
+        self._env = env
+        self._progress_callback = progress_callback
         super().__init__()
 
+    def resource_keys(
+        self, *, session: str | None = None, job_id: int | str | None = None, **kwargs
+    ) -> tuple[str, ...]:
+        # a job's polls go one at a time, commands and restarts in one session too
+        if job_id is not None:
+            return (f"{self.name}:job:{job_id}",)
+        if kwargs.get("background"):
+            return (f"{self.name}:jobs",)
+        return (f"{self.name}:{session or self.default_session}",)
+
     async def __call__(
-        self, command: str | None = None, restart: bool = False, **kwargs
+        self,
+        command: str | None = None,
+        restart: bool = False,
+        session: str | None = None,
+        background: bool = False,
+        job_id: int | str | None = None,
+        **kwargs,
     ):
-        if restart:
-            if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+        if job_id is not None:
+            if (job := self._jobs.get(_job_number(job_id))) is None:
+                raise ToolError(f"no background job {job_id}.")
+            return job.poll()
 
+        session = session or self.default_session
+        if restart:
+            if old := self._sessions.pop(session, None):
+                await old.close()
+            self._sessions[session] = await self._take_session()
             return ToolResult(system="tool has been restarted.")
 
-        if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+        if command is None:
+            raise ToolError("no command provided.")
+
+        if background:
+            job = _BackgroundJob(next(self._job_ids), command, env=self._env)
+            await job.start()
+            self._jobs[job.job_id] = job
+            return CLIResult(
+                output=(
+                    f"started background job {job.job_id} (process group {job.pid}); "
+                    f"call the tool with job_id {job.job_id} for its output"
+                )
+            )
+
+        if (shell := self._sessions.get(session)) is None:
+            shell = self._sessions[session] = await self._take_session()
+        return await shell.run(command)
+
+    async def close(self):
+        """Kill every session, pooled shell and background job, with what they started."""
+        if self._pool_task is not None:
+            # not cancelled, which could leave a shell started but not pooled
+            await self._pool_task
+            self._pool_task = None
+        shells = [*self._sessions.values(), *self._pool]
+        self._sessions.clear()
+        self._pool.clear()
+        jobs = list(self._jobs.values())
+        self._jobs.clear()
+        await asyncio.gather(
+            *(shell.close() for shell in shells), *(job.close() for job in jobs)
+        )
+
+    async def _take_session(self) -> _BashSession:
+        """A started shell, from the pool when it has one, which is then refilled."""
+        while self._pool:
+            shell = self._pool.pop()
+            if shell._process.returncode is None:
+                break
+            await shell.close()
+        else:
+            shell = self._new_session()
+            await shell.start()
+        if self._pool_task is None or self._pool_task.done():
+            self._pool_task = asyncio.create_task(self._fill_pool())
+        return shell
 
-        if command is not None:
-            return await self._session.run(command)
+    async def _fill_pool(self):
+        while len(self._pool) < self._pool_size:
+            shell = self._new_session()
+            await shell.start()
+            self._pool.append(shell)
 
-        raise ToolError("no command provided.")
+    def _new_session(self) -> _BashSession:
+        return _BashSession(env=self._env, progress_callback=self._progress_callback)
 
     def to_params(self) -> BetaToolBash20241022Param:
         return {
             "type": self.api_type,
             "name": self.name,
         }
+
+
+def _job_number(job_id: int | str) -> int:
+    try:
+        return int(job_id)
+    except ValueError:
+        raise ToolError(f"invalid job_id {job_id!r}, job ids are numbers.") from None
+
+
+def _shell_usage(pid: int) -> dict[str, float]:
+    """
+    CPU time and disk I/O of a shell and the children it has waited for, from
+    /proc: a command's usage is the difference across it. Peak memory can't be
+    told apart per command this way. Empty where /proc isn't available.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # the fields after the command name, which is in parentheses
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return {}
+    ticks = os.sysconf("SC_CLK_TCK")
+    # utime, stime, cutime and cstime are fields 14 to 17 of stat
+    utime, stime, cutime, cstime = (int(value) / ticks for value in fields[11:15])
+    return {
+        "cpu_user_s": utime + cutime,
+        "cpu_system_s": stime + cstime,
+        "read_bytes": int(io["read_bytes"]),
+        "written_bytes": int(io["write_bytes"]),
+    }
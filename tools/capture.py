@@ -0,0 +1,117 @@
+"""
+In-process screen capture.
+
+X11Capture grabs the framebuffer through Xlib, using a MIT-SHM segment the server
+writes into directly when the extension is available and a plain XGetImage
+otherwise. Frames come out as packed RGB pixels that can be handed straight to
+tools.imaging, without a helper process or a round-trip through the disk.
+"""
+
+import ctypes
+from dataclasses import dataclass
+
+from .x11 import LSB_FIRST, ShmImage, XDisplay, XError, XImage, get_image
+
+
+@dataclass(frozen=True)
+class Frame:
+    """Packed 8-bit RGB pixels, row after row."""
+
+    width: int
+    height: int
+    pixels: bytes
+
+
+class CaptureError(Exception):
+    """Raised when a frame can't be captured in-process."""
+
+
+class X11Capture:
+    """Screen grabs from one X display."""
+
+    def __init__(self, display: XDisplay):
+        self.display = display
+        self._shm: ShmImage | None = None
+        self._shm_size: tuple[int, int] | None = None
+        self._use_shm = display.has_shm
+
+    @classmethod
+    def open(cls, display_num: int | None) -> "X11Capture | None":
+        """Connect to the display, or None when in-process capture isn't possible."""
+        if (display := XDisplay.open(display_num)) is None:
+            return None
+        return cls(display)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.display.size
+
+    def grab(self, region: tuple[int, int, int, int] | None = None) -> Frame:
+        """Capture the whole screen, or the (x, y, width, height) region of it."""
+        if region is not None:
+            # one-off sizes, not worth a shared memory segment each
+            return self._get_image(*region)
+        width, height = self.size
+        if self._use_shm:
+            try:
+                if self._shm_size != (width, height):
+                    self._close_shm()
+                    self._shm = ShmImage(self.display, width, height)
+                    self._shm_size = (width, height)
+                assert self._shm is not None
+                image = self._shm.grab()
+                return _to_frame(image, _read(image))
+            except XError:
+                # e.g. a remote display: keep going without shared memory
+                self._close_shm()
+                self._use_shm = False
+        return self._get_image(0, 0, width, height)
+
+    def _get_image(self, x: int, y: int, width: int, height: int) -> Frame:
+        try:
+            image, data = get_image(self.display, x, y, width, height)
+        except XError as e:
+            raise CaptureError(str(e)) from None
+        return _to_frame(image, data)
+
+    def close(self):
+        self._close_shm()
+        self.display.close()
+
+    def _close_shm(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+            self._shm_size = None
+
+
+def _read(image: XImage) -> bytes:
+    return ctypes.string_at(image.data, image.bytes_per_line * image.height)
+
+
+def _to_frame(image: XImage, data: bytes) -> Frame:
+    """Convert a 32 bits per pixel TrueColor ZPixmap to packed RGB."""
+    if image.bits_per_pixel != 32 or (
+        image.red_mask,
+        image.green_mask,
+        image.blue_mask,
+    ) != (0xFF0000, 0xFF00, 0xFF):
+        raise CaptureError(
+            f"unsupported pixel format: {image.bits_per_pixel} bpp, "
+            f"masks {image.red_mask:#x}/{image.green_mask:#x}/{image.blue_mask:#x}"
+        )
+    width, height = image.width, image.height
+    row = width * 4
+    if image.bytes_per_line != row:
+        data = b"".join(
+            data[y * image.bytes_per_line : y * image.bytes_per_line + row]
+            for y in range(height)
+        )
+    # BGRX in memory on little-endian servers, XRGB on big-endian ones
+    red, green, blue = (2, 1, 0) if image.byte_order == LSB_FIRST else (1, 2, 3)
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = data[red::4]
+    rgb[1::3] = data[green::4]
+    rgb[2::3] = data[blue::4]
+    return Frame(width, height, bytes(rgb))
+
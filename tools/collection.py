@@ -1,5 +1,6 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
@@ -10,6 +11,7 @@ from .base import (
     ToolFailure,
     ToolResult,
 )
+from .tracing import span
 
 
 class ToolCollection:
@@ -18,17 +20,72 @@ class ToolCollection:
     def __init__(self, *tools: BaseAnthropicTool):
         self.tools = tools
         self.tool_map = {tool.to_params()["name"]: tool for tool in tools}
+        # last submitted call for each resource key, see BaseAnthropicTool.resource_keys
+        self._tails: dict[str, asyncio.Task[ToolResult]] = {}
 
     def to_params(
         self,
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
+    async def close(self):
+        for tool in self.tools:
+            await tool.close()
+
     async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
         try:
-            return await tool(**tool_input)
+            with span(f"tool.{name}", **_span_args(tool_input)) as span_args:
+                result = await tool(**tool_input)
+                if isinstance(result, ToolResult) and result.metadata:
+                    span_args.update(result.metadata)
+                return result
         except ToolError as e:
             return ToolFailure(error=e.message)
+
+    def submit(
+        self, *, name: str, tool_input: dict[str, Any]
+    ) -> asyncio.Task[ToolResult]:
+        """
+        Schedule a tool call and return its task without waiting for it.
+        The call starts once every earlier call sharing one of its resource keys
+        has finished, so e.g. computer actions and edits to one path keep their
+        order while unrelated calls overlap.
+        """
+        tool = self.tool_map.get(name)
+        keys = tool.resource_keys(**tool_input) if tool else ()
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        task = asyncio.create_task(
+            self._run_after(previous, name=name, tool_input=tool_input)
+        )
+        for key in keys:
+            self._tails[key] = task
+        task.add_done_callback(lambda _: self._release(keys, task))
+        return task
+
+    async def _run_after(
+        self,
+        previous: set[asyncio.Task[ToolResult]],
+        *,
+        name: str,
+        tool_input: dict[str, Any],
+    ) -> ToolResult:
+        if previous:
+            await asyncio.wait(previous)
+        return await self.run(name=name, tool_input=tool_input)
+
+    def _release(self, keys: tuple[str, ...], task: asyncio.Task[ToolResult]):
+        for key in keys:
+            if self._tails.get(key) is task:
+                del self._tails[key]
+
+
+def _span_args(tool_input: dict[str, Any]) -> dict[str, str]:
+    # enough to tell calls apart in a trace without copying whole file contents
+    return {
+        key: str(tool_input[key])[:80]
+        for key in ("action", "command", "path")
+        if key in tool_input
+    }
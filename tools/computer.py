@@ -1,26 +1,49 @@
+from __future__ import annotations
+
 import asyncio
 import base64
 import os
+import re
 import shlex
 import shutil
+import time
+from collections.abc import Awaitable, Callable
 from enum import StrEnum
 from pathlib import Path
-from typing import Literal, TypedDict
-from uuid import uuid4
+from typing import TYPE_CHECKING, Literal, TypedDict
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
+from .artifacts import ArtifactWriter
 from .base import BaseAnthropicTool, ToolError, ToolResult
-from .run import run
-
+from .capture import CaptureError, Frame, X11Capture
+from .run import run_with_usage
+from .scratch import ScratchFiles
+from .tracing import span
+from .x11 import XError
+from .xinput import XTestInput
 
-from ascii_magic import AsciiArt
 from datetime import datetime, timedelta
 
-OUTPUT_DIR = "/tmp/outputs"
+# numpy, PIL and ascii_magic are imported on first use: they make up most of the
+# import time of the tools, and a run may never take a screenshot
+if TYPE_CHECKING:
+    import numpy as np
+
+# screen sizes detected so far, by display number: every tool created for a
+# display (e.g. one per batch task) would otherwise probe it again
+_resolutions: dict[int | None, tuple[int, int]] = {}
+
+UNCHANGED_SCREEN_NOTE = "screen unchanged since previous screenshot"
+SETTLE_SAMPLE_STRIDE = 8
 
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
+# xdotool key's default delay between key combinations
+KEY_DELAY_MS = 12
+# key actions the XTEST backend takes; anything else, e.g. text the shell would
+# expand in `xdotool key -- {text}`, goes to xdotool as before
+PLAIN_KEYS = re.compile(r"[\w+\s]+")
 
 Action = Literal[
     "key",
@@ -33,6 +56,7 @@ Action = Literal[
     "double_click",
     "screenshot",
     "cursor_position",
+    "zoom",
 ]
 
 
@@ -65,6 +89,23 @@ def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
 
+def _print_preview(pixels: np.ndarray):
+    from ascii_magic import AsciiArt
+    from PIL import Image
+
+    with span("screenshot.ascii"):
+        AsciiArt.from_pillow_image(Image.fromarray(pixels)).to_terminal(columns=80)
+
+
+def _attach_screenshot(result: ToolResult, screenshot: ToolResult) -> ToolResult:
+    """Add the screenshot taken after an action to its result, or the note sent in its place."""
+    if screenshot.base64_image is not None:
+        return result.replace(base64_image=screenshot.base64_image)
+    return result.replace(
+        output="\n".join(filter(None, [result.output, screenshot.output]))
+    )
+
+
 class ComputerTool(BaseAnthropicTool):
     """
     A tool that allows the agent to interact with the screen, keyboard, and mouse of the current computer.
@@ -83,7 +124,32 @@ class ComputerTool(BaseAnthropicTool):
     last_screenshot_path: Path | None = None
 
     _screenshot_delay = 2.0
+    # "fixed" waits _screenshot_delay after each action before the screenshot,
+    # "adaptive" polls the screen until it stops changing (in-process capture only)
+    _settle_mode: Literal["fixed", "adaptive"] = "adaptive"
+    _settle_min_delay = 0.1
+    _settle_max_delay = 5.0
+    _settle_poll_interval = 0.1
+    # consecutive polls without change before the screen counts as settled
+    _settle_stable_frames = 3
+    # fraction of sampled pixels allowed to change between stable polls, so that a
+    # blinking caret or a small spinner doesn't keep the screen from settling
+    _settle_tolerance = 0.002
     _scaling_enabled = True
+    # grab the screen through Xlib instead of gnome-screenshot/scrot when possible
+    _in_process_capture = True
+    # send keyboard and mouse input through XTEST instead of xdotool when possible
+    _in_process_input = True
+    # seconds between two terminal previews of the screenshots
+    _ascii_preview_interval = 1.0
+    # zlib level of the screenshots sent to the API, 0-9 (imaging.PNG_COMPRESSION_LEVEL)
+    _png_compression_level = 6
+    # answer with UNCHANGED_SCREEN_NOTE instead of resending the previous screenshot
+    _skip_unchanged_screenshots = True
+    # also count as unchanged a screenshot whose perceptual hash is at most this many
+    # bits (out of 256) away from the previous one; None compares exact pixels only.
+    # The hash is coarse: a few typed characters often don't change it at all
+    _unchanged_hash_threshold: int | None = None
 
     @property
     def options(self) -> ComputerToolOptions:
@@ -99,9 +165,15 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
-    def __init__(self, width=None, height=None):
+    def __init__(
+        self,
+        width=None,
+        height=None,
+        display_num: int | None = None,
+        ascii_preview: bool | None = None,
+    ):
         super().__init__()
-        
+
         if width is None:
             self.width = int(os.getenv("WIDTH")) if os.getenv("WIDTH") else None
         else:
@@ -111,8 +183,10 @@ class ComputerTool(BaseAnthropicTool):
         else:
             self.height = height
 
-        if (display_num := os.getenv("DISPLAY_NUM")) is not None:
-            self.display_num = int(display_num)
+        if display_num is None and (env_display := os.getenv("DISPLAY_NUM")) is not None:
+            display_num = int(env_display)
+        if display_num is not None:
+            self.display_num = display_num
             self._display_prefix = f"DISPLAY=:{self.display_num} "
         else:
             self.display_num = None
@@ -120,9 +194,46 @@ class ComputerTool(BaseAnthropicTool):
 
         self.xdotool = f"{self._display_prefix}xdotool"
 
+        if ascii_preview is None:
+            ascii_preview = os.getenv("ASCII_PREVIEW", "1") != "0"
+        self.ascii_preview = ascii_preview
+        # latest screenshot waiting for a preview, older ones are dropped
+        self._preview_pixels: np.ndarray | None = None
+        self._preview_task: asyncio.Task | None = None
+        self._preview_at = 0.0
+        self._capture: X11Capture | None = None
+        self._capture_opened = False
+        # files for the screenshot commands, which can't write to memory
+        self._scratch = ScratchFiles(prefix=f"{self.name}-screenshots")
+        self._input: XTestInput | None = None
+        self._input_opened = False
+        # the last screenshot actually sent, to recognize unchanged screens
+        self._last_digest: bytes | None = None
+        self._last_hash: int | None = None
+        self.skipped_screenshots = 0
+
         if self.debug:
             self.debug_path = Path().resolve() / self.debug_dir
-            self.debug_path.mkdir(parents=True, exist_ok=True)
+            self._artifacts = ArtifactWriter(self.debug_path, prefix="screen-")
+            self._debug_pixels: np.ndarray | None = None
+
+    def resource_keys(self, **kwargs) -> tuple[str, ...]:
+        # every action moves the pointer, types or looks at the same screen
+        return (f"{self.name}:{self.display_num}",)
+
+    async def close(self):
+        """Finish writing debug screenshots and release the X connections."""
+        if self._preview_task is not None:
+            await self._preview_task
+        if self.debug:
+            await self._artifacts.close()
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+        if self._input is not None:
+            self._input.close()
+            self._input = None
+        self._scratch.close()
 
     async def ensure_initialized(self):
         if self.width is None or self.height is None:
@@ -134,6 +245,7 @@ class ComputerTool(BaseAnthropicTool):
         action: Action,
         text: str | None = None,
         coordinate: tuple[int, int] | None = None,
+        region: tuple[int, int, int, int] | None = None,
         **kwargs,
     ):
         if action in ("mouse_move", "left_click_drag"):
@@ -152,13 +264,15 @@ class ComputerTool(BaseAnthropicTool):
 
             if action == "mouse_move":
                 if self.debug:
-                    command = f"convert -pointsize 40 -fill blue -draw 'translate {coordinate[0]},{coordinate[1]} roundrectangle -5,-5 5,5 10,10' {self.last_screenshot_path} {self.last_screenshot_path}"
-                    await self.shell(command, take_screenshot=False)
+                    self._mark_debug_screenshot(coordinate[0], coordinate[1])
 
-                return await self.shell(f"{self.xdotool} mousemove --sync {x} {y}")
+                return await self._input_action(
+                    f"mousemove --sync {x} {y}", lambda xinput: xinput.move(x, y)
+                )
             elif action == "left_click_drag":
-                return await self.shell(
-                    f"{self.xdotool} mousedown 1 mousemove --sync {x} {y} mouseup 1"
+                return await self._input_action(
+                    f"mousedown 1 mousemove --sync {x} {y} mouseup 1",
+                    lambda xinput: xinput.drag(x, y),
                 )
 
         if action in ("key", "type"):
@@ -170,17 +284,28 @@ class ComputerTool(BaseAnthropicTool):
                 raise ToolError(output=f"{text} must be a string")
 
             if action == "key":
-                return await self.shell(f"{self.xdotool} key -- {text}")
+                return await self._input_action(
+                    f"key -- {text}",
+                    (lambda xinput: xinput.key(text, KEY_DELAY_MS / 1000))
+                    if PLAIN_KEYS.fullmatch(text)
+                    else None,
+                )
             elif action == "type":
                 results: list[ToolResult] = []
                 for chunk in chunks(text, TYPING_GROUP_SIZE):
-                    cmd = f"{self.xdotool} type --delay {TYPING_DELAY_MS} -- {shlex.quote(chunk)}"
-                    results.append(await self.shell(cmd, take_screenshot=False))
-                screenshot_base64 = (await self.screenshot()).base64_image
-                return ToolResult(
-                    output="".join(result.output or "" for result in results),
-                    error="".join(result.error or "" for result in results),
-                    base64_image=screenshot_base64,
+                    results.append(
+                        await self._input_action(
+                            f"type --delay {TYPING_DELAY_MS} -- {shlex.quote(chunk)}",
+                            lambda xinput: xinput.type(chunk, TYPING_DELAY_MS / 1000),
+                            take_screenshot=False,
+                        )
+                    )
+                return _attach_screenshot(
+                    ToolResult(
+                        output="".join(result.output or "" for result in results),
+                        error="".join(result.error or "" for result in results),
+                    ),
+                    await self.screenshot(),
                 )
 
         if action in (
@@ -199,67 +324,142 @@ class ComputerTool(BaseAnthropicTool):
             if action == "screenshot":
                 return await self.screenshot()
             elif action == "cursor_position":
-                result = await self.shell(
-                    f"{self.xdotool} getmouselocation --shell",
-                    take_screenshot=False,
-                )
-                output = result.output or ""
-                x, y = self.scale_coordinates(
-                    ScalingSource.COMPUTER,
-                    int(output.split("X=")[1].split("\n")[0]),
-                    int(output.split("Y=")[1].split("\n")[0]),
-                )
+                if (xinput := self._input_backend()) is not None:
+                    result = ToolResult(output="", error="")
+                    x, y = xinput.pointer()
+                else:
+                    result = await self.shell(
+                        f"{self.xdotool} getmouselocation --shell",
+                        take_screenshot=False,
+                    )
+                    output = result.output or ""
+                    x = int(output.split("X=")[1].split("\n")[0])
+                    y = int(output.split("Y=")[1].split("\n")[0])
+                x, y = self.scale_coordinates(ScalingSource.COMPUTER, x, y)
                 return result.replace(output=f"X={x},Y={y}")
             else:
-                click_arg = {
-                    "left_click": "1",
-                    "right_click": "3",
-                    "middle_click": "2",
-                    "double_click": "--repeat 2 --delay 500 1",
+                click_arg, button, repeat = {
+                    "left_click": ("1", 1, 1),
+                    "right_click": ("3", 3, 1),
+                    "middle_click": ("2", 2, 1),
+                    "double_click": ("--repeat 2 --delay 500 1", 1, 2),
                 }[action]
-                return await self.shell(f"{self.xdotool} click {click_arg}")
+                return await self._input_action(
+                    f"click {click_arg}",
+                    lambda xinput: xinput.click(button, repeat, delay=0.5),
+                )
+
+        if action == "zoom":
+            if region is None:
+                raise ToolError(f"region is required for {action}")
+            if text is not None or coordinate is not None:
+                raise ToolError(f"text and coordinate are not accepted for {action}")
+            if not isinstance(region, list) or len(region) != 4:
+                raise ToolError(f"{region} must be a tuple of length 4")
+            if not all(isinstance(i, int) and i >= 0 for i in region):
+                raise ToolError(f"{region} must be a tuple of non-negative ints")
+            if region[0] >= region[2] or region[1] >= region[3]:
+                raise ToolError(f"{region} must be [x0, y0, x1, y1] with x0 < x1 and y0 < y1")
+            return await self.zoom(region)
 
         raise ToolError(f"Invalid action: {action}")
 
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
-
-        # Try gnome-screenshot first
-        if shutil.which("gnome-screenshot"):
-            screenshot_cmd = f"{self._display_prefix}gnome-screenshot -f {path} -p"
-        else:
-            # Fall back to scrot if gnome-screenshot isn't available
-            screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
+        from .imaging import encode_png, frame_to_array, resize
 
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
-        AsciiArt.from_image(path).to_terminal(columns=80)
+        with span("screenshot.capture"):
+            if (frame := self._grab_frame()) is not None:
+                pixels = frame_to_array(frame)
+                result = ToolResult()
+            else:
+                result, pixels = await self._screenshot_command()
+        if pixels is None:
+            raise ToolError(f"Failed to take screenshot: {result.error}")
         if self._scaling_enabled:
             x, y = self.scale_coordinates(
                 ScalingSource.COMPUTER, self.width, self.height
             )
-            await self.shell(
-                f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
-            )
-
-        if path.exists():
-            if self.debug:
+            with span("screenshot.resize"):
+                pixels = resize(pixels, x, y)
+        if self._skip_unchanged_screenshots:
+            with span("screenshot.compare"):
+                unchanged = self._unchanged(pixels)
+            if unchanged:
+                self.skipped_screenshots += 1
+                return result.replace(output=UNCHANGED_SCREEN_NOTE)
+        if self.ascii_preview:
+            self._schedule_preview(pixels)
+
+        with span("screenshot.encode"):
+            png = encode_png(pixels, self._png_compression_level)
+            base64_image = base64.b64encode(png).decode()
+        if self.debug:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            self.last_screenshot_path = self._artifacts.submit(f"screen-{timestamp}.png", png)
+            self._debug_pixels = pixels
+        return result.replace(base64_image=base64_image)
+
+    def _mark_debug_screenshot(self, x: int, y: int):
+        """Mark where the pointer is sent on the last debug screenshot, rewriting it."""
+        if self._debug_pixels is None or self.last_screenshot_path is None:
+            return
+        from .imaging import draw_marker, encode_png
+
+        marked = self._debug_pixels = draw_marker(self._debug_pixels, x, y)
+        self._artifacts.submit(
+            self.last_screenshot_path.name,
+            lambda: encode_png(marked, self._png_compression_level),
+        )
 
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                shutil.copy(path, self.debug_path / f"screen-{timestamp}.{path.suffix}")
-                self.last_screenshot_path = self.debug_path / path.name
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
-        raise ToolError(f"Failed to take screenshot: {result.error}")
+    async def zoom(self, region: list[int]) -> ToolResult:
+        """
+        Screenshot of the [x0, y0, x1, y1] region, in screenshot coordinates, at
+        the screen's native resolution, only scaled down if it's larger than a
+        full screenshot.
+        """
+        from .imaging import encode_png, frame_to_array, resize
+
+        x0, y0 = self.scale_coordinates(ScalingSource.API, region[0], region[1])
+        x1, y1 = self.scale_coordinates(ScalingSource.API, region[2], region[3])
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+        if x0 >= x1 or y0 >= y1:
+            raise ToolError(f"Region {region} is outside of the screen")
+        with span("screenshot.capture", region=f"{x0},{y0},{x1},{y1}"):
+            if (frame := self._grab_frame((x0, y0, x1 - x0, y1 - y0))) is not None:
+                pixels = frame_to_array(frame)
+                result = ToolResult()
+            else:
+                result, pixels = await self._screenshot_command()
+                if pixels is not None:
+                    pixels = pixels[y0:y1, x0:x1]
+        if pixels is None:
+            raise ToolError(f"Failed to take screenshot: {result.error}")
+        max_width, max_height = self.scale_coordinates(
+            ScalingSource.COMPUTER, self.width, self.height
+        )
+        height, width, _ = pixels.shape
+        if width > max_width or height > max_height:
+            factor = min(max_width / width, max_height / height)
+            with span("screenshot.resize"):
+                pixels = resize(pixels, round(width * factor), round(height * factor))
+        with span("screenshot.encode"):
+            png = encode_png(pixels, self._png_compression_level)
+            base64_image = base64.b64encode(png).decode()
+        if self.debug:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            self._artifacts.submit(f"screen-{timestamp}-zoom.png", png)
+        return result.replace(
+            output=(
+                f"region {region} at {pixels.shape[1]}x{pixels.shape[0]}; "
+                "coordinates still refer to the full screenshot"
+            ),
+            base64_image=base64_image,
+        )
 
-    async def autodetect_resolution(self):
-        """Autodetect the resolution of the current screen."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
+    async def _screenshot_command(self) -> tuple[ToolResult, np.ndarray | None]:
+        """Take a screenshot with gnome-screenshot or scrot, which can only write it to a file."""
+        path = self._scratch.path(".png")
 
         # Try gnome-screenshot first
         if shutil.which("gnome-screenshot"):
@@ -268,23 +468,170 @@ class ComputerTool(BaseAnthropicTool):
             # Fall back to scrot if gnome-screenshot isn't available
             screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
         result = await self.shell(screenshot_cmd, take_screenshot=False)
-        width_output = await self.shell(f'identify -format "%w" {path}', take_screenshot=False)
-        height_output = await self.shell(f'identify -format "%h" {path}', take_screenshot=False)
-        self.width = int(width_output.output)
-        self.height = int(height_output.output)
-        assert self.width is not None and self.height is not None
+        if not path.exists():
+            return result, None
+        from .imaging import load_image
+
+        return result, load_image(path)
+
+    async def _settle(self) -> float:
+        """Wait for the screen to settle after an action, returning the seconds waited."""
+        start = time.monotonic()
+        if self._settle_mode != "adaptive" or (previous := self._settle_sample()) is None:
+            await asyncio.sleep(self._screenshot_delay)
+            return time.monotonic() - start
+        from .imaging import changed_fraction
+
+        await asyncio.sleep(self._settle_min_delay)
+        stable = 0
+        while (
+            stable < self._settle_stable_frames
+            and time.monotonic() - start < self._settle_max_delay
+        ):
+            await asyncio.sleep(self._settle_poll_interval)
+            if (sample := self._settle_sample()) is None:
+                break
+            if changed_fraction(previous, sample) <= self._settle_tolerance:
+                stable += 1
+            else:
+                stable = 0
+            previous = sample
+        return time.monotonic() - start
+
+    def _settle_sample(self) -> np.ndarray | None:
+        """A cheap low resolution view of the screen: every SETTLE_SAMPLE_STRIDE-th pixel."""
+        if (frame := self._grab_frame()) is None:
+            return None
+        from .imaging import frame_to_array
+
+        return frame_to_array(frame)[::SETTLE_SAMPLE_STRIDE, ::SETTLE_SAMPLE_STRIDE]
+
+    def _schedule_preview(self, pixels: np.ndarray):
+        """Print an ASCII preview of the screenshot to the terminal, in the background."""
+        self._preview_pixels = pixels
+        if self._preview_task is None or self._preview_task.done():
+            self._preview_task = asyncio.create_task(self._preview_loop())
+
+    async def _preview_loop(self):
+        while self._preview_pixels is not None:
+            if (wait := self._preview_at + self._ascii_preview_interval - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+            pixels, self._preview_pixels = self._preview_pixels, None
+            self._preview_at = time.monotonic()
+            await asyncio.to_thread(_print_preview, pixels)
+
+    def _unchanged(self, pixels: np.ndarray) -> bool:
+        """Whether the screen looks the same as in the last screenshot sent, remembering it if not."""
+        from .imaging import digest, hash_distance, perceptual_hash
+
+        frame_digest = digest(pixels)
+        if frame_digest == self._last_digest:
+            return True
+        frame_hash = None
+        if self._unchanged_hash_threshold is not None:
+            frame_hash = perceptual_hash(pixels)
+            if (
+                self._last_hash is not None
+                and hash_distance(frame_hash, self._last_hash) <= self._unchanged_hash_threshold
+            ):
+                return True
+        self._last_digest, self._last_hash = frame_digest, frame_hash
+        return False
+
+    def _grab_frame(self, region: tuple[int, int, int, int] | None = None) -> Frame | None:
+        """
+        Grab the screen, or its (x, y, width, height) region, in-process; None to
+        use the screenshot commands instead.
+        """
+        if self._open_capture() is None:
+            return None
+        assert self._capture is not None
+        try:
+            return self._capture.grab(region)
+        except CaptureError:
+            self._capture.close()
+            self._capture = None
+            return None
+
+    def _open_capture(self) -> X11Capture | None:
+        """The in-process capture, connecting on first use; None when unavailable."""
+        if not self._in_process_capture:
+            return None
+        if not self._capture_opened:
+            self._capture_opened = True
+            self._capture = X11Capture.open(self.display_num)
+        return self._capture
+
+    async def autodetect_resolution(self):
+        """Autodetect the resolution of the current screen."""
+        if (size := _resolutions.get(self.display_num)) is None:
+            if (capture := self._open_capture()) is not None:
+                # the root window's size, without taking a screenshot
+                size = capture.size
+            else:
+                result, pixels = await self._screenshot_command()
+                if pixels is None:
+                    raise ToolError(f"Failed to take screenshot: {result.error}")
+                size = pixels.shape[1], pixels.shape[0]
+            _resolutions[self.display_num] = size
+        self.width, self.height = size
 
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
-        _, stdout, stderr = await run(command)
-        base64_image = None
+        program = command.removeprefix(self._display_prefix).split(" ", 1)[0]
+        with span("computer.command", program=program):
+            _, stdout, stderr, usage = await run_with_usage(command)
+        return await self._after_action(
+            ToolResult(output=stdout, error=stderr, metadata=usage), take_screenshot
+        )
 
+    async def _input_action(
+        self,
+        xdotool_args: str,
+        inject: Callable[[XTestInput], Awaitable[bool]] | None,
+        take_screenshot=True,
+    ) -> ToolResult:
+        """
+        Perform an input action through XTEST with `inject`, or by running
+        `xdotool {xdotool_args}` when XTEST is unavailable or can't do it.
+        Both give the same ToolResult, with empty output and error on success.
+        """
+        if inject is not None and (xinput := self._input_backend()) is not None:
+            error = ""
+            with span("computer.inject"):
+                try:
+                    done = await inject(xinput)
+                except XError as e:
+                    done, error = True, str(e)
+            if done:
+                return await self._after_action(
+                    ToolResult(output="", error=error), take_screenshot
+                )
+        return await self.shell(f"{self.xdotool} {xdotool_args}", take_screenshot)
+
+    def _input_backend(self) -> XTestInput | None:
+        if not self._in_process_input:
+            return None
+        if not self._input_opened:
+            self._input_opened = True
+            self._input = XTestInput.open(self.display_num)
+        return self._input
+
+    async def _after_action(self, result: ToolResult, take_screenshot: bool) -> ToolResult:
+        """Add the screenshot taken once the screen has settled, if asked for."""
         if take_screenshot:
             # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
-            base64_image = (await self.screenshot()).base64_image
+            with span("computer.settle"):
+                waited = await self._settle()
+            result = _attach_screenshot(result, await self.screenshot()).replace(
+                metadata={
+                    **(result.metadata or {}),
+                    "settle_s": round(waited, 3),
+                    "settle_saved_s": round(self._screenshot_delay - waited, 3),
+                }
+            )
 
-        return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
+        return result
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
@@ -1,3 +1,4 @@
+import os
 from collections import defaultdict
 from pathlib import Path
 from typing import Literal, get_args
@@ -32,6 +33,12 @@ class EditTool(BaseAnthropicTool):
         self._file_history = defaultdict(list)
         super().__init__()
 
+    def resource_keys(self, *, path: str | None = None, **kwargs) -> tuple[str, ...]:
+        # views and edits of the same file must not overtake each other
+        if not isinstance(path, str):
+            return (self.name,)
+        return (f"{self.name}:{os.path.normpath(path)}",)
+
     def to_params(self) -> BetaToolTextEditor20241022Param:
         return {
             "name": self.name,
@@ -0,0 +1,150 @@
+"""
+In-memory screenshot processing.
+
+Screenshots stay as (height, width, 3) uint8 RGB arrays from capture to base64:
+they are downscaled to the API resolution with vectorized box averaging and
+encoded to PNG without going through the disk or ImageMagick.
+"""
+
+import hashlib
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from .capture import Frame
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# zlib level: 1 encodes about twice as fast as 6, for larger PNGs on flat desktops
+PNG_COMPRESSION_LEVEL: int = 6
+PNG_FILTER_NONE = 0
+PNG_FILTER_UP = 2
+# perceptual hashes compare a PERCEPTUAL_HASH_SIZE x PERCEPTUAL_HASH_SIZE grid
+PERCEPTUAL_HASH_SIZE: int = 16
+
+
+def frame_to_array(frame: Frame) -> np.ndarray:
+    """View a captured frame as an RGB array, without copying."""
+    return np.frombuffer(frame.pixels, dtype=np.uint8).reshape(
+        frame.height, frame.width, 3
+    )
+
+
+def load_image(path: Path) -> np.ndarray:
+    """Decode an image file written by a screenshot command to an RGB array."""
+    # only needed without in-process capture, so PIL is imported on demand
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def resize(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Scale an RGB array to width x height. Each output pixel is the average of the
+    source area it covers, weighting partly covered pixels by their overlap, which
+    keeps thin UI lines and text legible where nearest-neighbour would drop them.
+    """
+    if pixels.shape[:2] == (height, width):
+        return pixels
+    # rows first: gathering whole rows is cheaper than gathering pixels
+    scaled = _resize_axis(pixels, height, axis=0)
+    scaled = _resize_axis(scaled, width, axis=1)
+    return np.clip(np.rint(scaled), 0, 255).astype(np.uint8)
+
+
+def _resize_axis(pixels: np.ndarray, size: int, axis: int) -> np.ndarray:
+    length = pixels.shape[axis]
+    scale = length / size
+    # output pixel i covers the source interval [i * scale, (i + 1) * scale)
+    start = np.arange(size) * scale
+    first = np.floor(start).astype(np.intp)
+    taps = int(np.ceil(scale)) + 1
+    index = first[:, None] + np.arange(taps)
+    overlap = np.minimum(start[:, None] + scale, index + 1) - np.maximum(start[:, None], index)
+    weights = (np.clip(overlap, 0, None) / scale).astype(np.float32)
+    index = np.minimum(index, length - 1)
+    shape = [-1 if i == axis else 1 for i in range(pixels.ndim)]
+    # a handful of weighted gathers, each the size of the output
+    result = np.zeros(
+        [size if i == axis else n for i, n in enumerate(pixels.shape)], dtype=np.float32
+    )
+    for tap in range(taps):
+        result += np.take(pixels, index[:, tap], axis=axis) * weights[:, tap].reshape(shape)
+    return result
+
+
+def digest(pixels: np.ndarray) -> bytes:
+    """Hash of the exact pixel values."""
+    return hashlib.blake2b(np.ascontiguousarray(pixels).data, digest_size=16).digest()
+
+
+def perceptual_hash(pixels: np.ndarray, size: int = PERCEPTUAL_HASH_SIZE) -> int:
+    """
+    Difference hash: one bit per cell of a size x size grid, set when the cell is
+    brighter than its right neighbour. Similar images have hashes a few bits apart.
+    """
+    cells = resize(pixels, size + 1, size).astype(np.float32)
+    luma = cells @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    bits = np.packbits(luma[:, 1:] > luma[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def hash_distance(a: int, b: int) -> int:
+    """Number of bits two perceptual hashes differ by."""
+    return (a ^ b).bit_count()
+
+
+def changed_fraction(a: np.ndarray, b: np.ndarray) -> float:
+    """Fraction of the pixels that differ between two images of the same size."""
+    return float(np.any(a != b, axis=-1).mean())
+
+
+def draw_marker(
+    pixels: np.ndarray, x: int, y: int, radius: int = 5, color=(0, 0, 255)
+) -> np.ndarray:
+    """A copy of the image with a filled square centered on (x, y)."""
+    marked = pixels.copy()
+    marked[max(0, y - radius) : y + radius + 1, max(0, x - radius) : x + radius + 1] = color
+    return marked
+
+
+def encode_png(
+    pixels: np.ndarray,
+    compression_level: int = PNG_COMPRESSION_LEVEL,
+    filter_type: int = PNG_FILTER_UP,
+) -> bytes:
+    """
+    Encode an RGB array as a PNG. The Up filter stores each row as its difference
+    with the row above, turning the flat areas of a desktop into runs of zeros,
+    which usually compresses a little better than raw rows.
+    """
+    height, width, _ = pixels.shape
+    rows = np.ascontiguousarray(pixels).reshape(height, width * 3)
+    raw = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = filter_type
+    if filter_type == PNG_FILTER_UP:
+        raw[0, 1:] = rows[0]
+        # uint8 arithmetic wraps around, i.e. the difference modulo 256
+        np.subtract(rows[1:], rows[:-1], out=raw[1:, 1:])
+    else:
+        raw[:, 1:] = rows
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"".join(
+        [
+            PNG_SIGNATURE,
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(raw.data, compression_level)),
+            _png_chunk(b"IEND", b""),
+        ]
+    )
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
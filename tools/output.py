@@ -0,0 +1,116 @@
+"""
+Bounded capture of command output.
+
+HeadTailBuffer keeps the first and the last bytes written to it and only counts
+the ones in between, so a command printing gigabytes costs a fixed amount of
+memory while what usually matters, the start of the output and the error at its
+end, is kept. Given a spill name, it also copies an output that doesn't fit to a
+file under SPILL_DIR, as it's written, and the clipped text points to that file.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+from .scratch import OUTPUT_DIR
+
+OUTPUT_HEAD_BYTES = 8000
+OUTPUT_TAIL_BYTES = 8000
+CLIPPED_MESSAGE = "\n<response clipped: {omitted} bytes omitted>\n"
+SPILLED_MESSAGE = (
+    "\n<response clipped: {omitted} bytes omitted, the whole output is in {path}; "
+    "search it with `grep -n` or print parts of it with `sed -n`>\n"
+)
+SPILL_DIR = os.path.join(OUTPUT_DIR, "spill")
+# spill files kept, the oldest are deleted when a new one is created
+SPILL_MAX_FILES = 100
+
+
+class HeadTailBuffer:
+    """The head and the tail of a stream of bytes."""
+
+    def __init__(
+        self,
+        head_size: int = OUTPUT_HEAD_BYTES,
+        tail_size: int = OUTPUT_TAIL_BYTES,
+        spill_name: str | None = None,
+    ):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.spill_name = spill_name
+        self.spill_path: Path | None = None
+        self._spill_file: BinaryIO | None = None
+        # bytes written so far, retained or not
+        self.total = 0
+        self._head = bytearray()
+        # holds up to twice tail_size, so that it's trimmed once per tail_size bytes
+        self._tail = bytearray()
+
+    def write(self, data: bytes | bytearray | memoryview):
+        if self.spill_name is not None and self._spill_file is None:
+            if self.total + len(data) > self.head_size + self.tail_size:
+                # nothing was dropped yet: the head and tail are all of it so far
+                self._spill_file, self.spill_path = _create_spill_file(self.spill_name)
+                self._spill_file.write(self._head)
+                self._spill_file.write(self._tail)
+        if self._spill_file is not None:
+            self._spill_file.write(data)
+        self.total += len(data)
+        data = memoryview(data)
+        if (room := self.head_size - len(self._head)) > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if data and self.tail_size:
+            self._tail += data[-self.tail_size :]
+            if len(self._tail) > 2 * self.tail_size:
+                del self._tail[: -self.tail_size]
+
+    @property
+    def tail(self) -> bytes:
+        return bytes(self._tail[-self.tail_size :]) if self.tail_size else b""
+
+    @property
+    def omitted(self) -> int:
+        """Number of bytes left out between the head and the tail."""
+        return self.total - len(self._head) - len(self.tail)
+
+    def getvalue(self) -> bytes:
+        return bytes(self._head) + self.tail
+
+    def text(self) -> str:
+        """The retained output as text, with a note where bytes were left out."""
+        if not self.omitted:
+            return self.getvalue().decode(errors="replace")
+        if self.spill_path is not None:
+            message = SPILLED_MESSAGE.format(omitted=self.omitted, path=self.spill_path)
+        else:
+            message = CLIPPED_MESSAGE.format(omitted=self.omitted)
+        # decoded apart, so that no character is made of bytes from both sides
+        return (
+            self._head.decode(errors="replace")
+            + message
+            + self.tail.decode(errors="replace")
+        )
+
+    def close(self):
+        """Finish the spill file, if there is one."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _create_spill_file(name: str) -> tuple[BinaryIO, Path]:
+    directory = Path(SPILL_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    spilled = sorted(directory.iterdir(), key=lambda path: path.stat().st_mtime)
+    for path in spilled[: max(0, len(spilled) - SPILL_MAX_FILES + 1)]:
+        path.unlink(missing_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f"{name}-", suffix=".log", dir=directory)
+    return os.fdopen(fd, "wb"), Path(path)
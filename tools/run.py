@@ -1,9 +1,23 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import os
+import resource
+import subprocess
+import weakref
+from collections.abc import Callable
+from typing import IO
+
+from .output import OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES, HeadTailBuffer
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
+# most bytes taken from a pipe per read
+READ_SIZE: int = 1 << 16
+# commands, from run() or a bash session, running at the same time in the process
+MAX_CONCURRENT_COMMANDS: int = int(
+    os.getenv("MAX_CONCURRENT_COMMANDS", str(os.cpu_count() or 4))
+)
 
 
 def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
@@ -18,26 +32,148 @@ def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
 async def run(
     cmd: str,
     timeout: float | None = 120.0,  # seconds
-    truncate_after: int | None = MAX_RESPONSE_LEN,
+    head_size: int = OUTPUT_HEAD_BYTES,
+    tail_size: int = OUTPUT_TAIL_BYTES,
 ):
-    #print("hello", cmd, timeout, truncate_after)
-    """Run a shell command asynchronously with a timeout."""
-    process = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
+    """
+    Run a shell command asynchronously with a timeout. Of stdout and stderr, the
+    first head_size and last tail_size bytes are returned, the whole of a longer
+    output is spilled to a file named in the clipped text.
+    """
+    returncode, stdout, stderr, _ = await run_with_usage(cmd, timeout, head_size, tail_size)
+    return returncode, stdout, stderr
+
 
-    try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
+async def run_with_usage(
+    cmd: str,
+    timeout: float | None = 120.0,  # seconds
+    head_size: int = OUTPUT_HEAD_BYTES,
+    tail_size: int = OUTPUT_TAIL_BYTES,
+) -> tuple[int, str, str, dict[str, float]]:
+    """
+    Like run(), also returning the resources the command used, see rusage_metadata.
+    At most MAX_CONCURRENT_COMMANDS commands run at once, each under COMMAND_LIMITS.
+    """
+    async with command_slot():
+        # not asyncio.create_subprocess_shell: its child watcher reaps the process
+        # with waitpid, which drops the resource usage wait4 returns
+        process = subprocess.Popen(
+            cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=limit_resources(COMMAND_LIMITS),
         )
-    except asyncio.TimeoutError as exc:
+        transports: list[asyncio.BaseTransport] = []
         try:
-            process.kill()
-        except ProcessLookupError:
-            pass
-        raise TimeoutError(
-            f"Command '{cmd}' timed out after {timeout} seconds"
-        ) from exc
+            with (
+                HeadTailBuffer(head_size, tail_size, spill_name="stdout") as stdout,
+                HeadTailBuffer(head_size, tail_size, spill_name="stderr") as stderr,
+            ):
+                async with asyncio.timeout(timeout):
+                    assert process.stdout and process.stderr
+                    _, _, (_, status, rusage) = await asyncio.gather(
+                        _read_into(process.stdout, stdout, transports),
+                        _read_into(process.stderr, stderr, transports),
+                        asyncio.to_thread(os.wait4, process.pid, 0),
+                    )
+        except asyncio.TimeoutError as exc:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            raise TimeoutError(
+                f"Command '{cmd}' timed out after {timeout} seconds"
+            ) from exc
+        finally:
+            for transport in transports:
+                transport.close()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return (
+        process.returncode or 0,
+        stdout.text(),
+        stderr.text(),
+        rusage_metadata(rusage),
+    )
+
+
+async def _read_into(pipe: IO[bytes], output: HeadTailBuffer, transports: list):
+    reader = asyncio.StreamReader(limit=READ_SIZE)
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    transports.append(transport)
+    while chunk := await reader.read(READ_SIZE):
+        output.write(chunk)
+
+
+def rusage_metadata(rusage: resource.struct_rusage) -> dict[str, float]:
+    """
+    CPU time, peak memory and disk I/O of a finished command, for ToolResult.metadata.
+    They cover the processes it waited for too, e.g. those of a pipeline. Linux
+    counts the memory of a child from before it exec'd, so max_rss_kb is never
+    below the size of this process.
+    """
+    return {
+        "cpu_user_s": round(rusage.ru_utime, 3),
+        "cpu_system_s": round(rusage.ru_stime, 3),
+        "max_rss_kb": rusage.ru_maxrss,
+        # counted in 512 byte blocks, reads served by the page cache don't count
+        "read_bytes": rusage.ru_inblock * 512,
+        "written_bytes": rusage.ru_oublock * 512,
+    }
+
+
+def command_slot() -> asyncio.Semaphore:
+    """The semaphore capping how many commands run at once, for the running event loop."""
+    loop = asyncio.get_running_loop()
+    if (slots := _command_slots.get(loop)) is None:
+        slots = _command_slots[loop] = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
+    return slots
+
+
+def resource_limits(
+    prefix: str,
+    memory_mb: int | None = None,
+    cpu_seconds: int | None = None,
+    open_files: int | None = None,
+) -> dict[int, int]:
+    """
+    rlimits read from the {prefix}_MAX_MEMORY_MB, {prefix}_MAX_CPU_SECONDS and
+    {prefix}_MAX_OPEN_FILES environment variables, with the given defaults.
+    0 means no limit.
+    """
+    limits = {}
+    for name, rlimit, scale, default in (
+        ("MAX_MEMORY_MB", resource.RLIMIT_AS, 1 << 20, memory_mb),
+        ("MAX_CPU_SECONDS", resource.RLIMIT_CPU, 1, cpu_seconds),
+        ("MAX_OPEN_FILES", resource.RLIMIT_NOFILE, 1, open_files),
+    ):
+        value = os.getenv(f"{prefix}_{name}")
+        if value := int(value) if value else default:
+            limits[rlimit] = value * scale
+    return limits
+
+
+def limit_resources(limits: dict[int, int], new_session: bool = False) -> Callable[[], None]:
+    """A preexec_fn applying `limits` to the child, optionally in a session of its own."""
+
+    def preexec():
+        if new_session:
+            os.setsid()
+        for rlimit, value in limits.items():
+            _, hard = resource.getrlimit(rlimit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(rlimit, (value, value))
+
+    return preexec
+
+
+# address space, CPU time and file descriptors of each command run() starts
+COMMAND_LIMITS: dict[int, int] = resource_limits(
+    "COMMAND", memory_mb=4096, cpu_seconds=120, open_files=4096
+)
+_command_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
@@ -0,0 +1,54 @@
+"""
+Scratch files for the command line tools that can only write to a path.
+
+ScratchFiles hands out a small ring of reusable file names in a private
+directory, on tmpfs (/dev/shm) when there is one so the data never reaches a
+disk, under /tmp/outputs otherwise. Names are reused round-robin, so a long run
+leaves at most `slots` files behind, and close() removes the directory.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+TMPFS_DIR = "/dev/shm"
+OUTPUT_DIR = "/tmp/outputs"
+SCRATCH_SLOTS = 4
+
+
+class ScratchFiles:
+    """A ring of reusable scratch file paths."""
+
+    def __init__(self, slots: int = SCRATCH_SLOTS, prefix: str = "scratch"):
+        self.slots = slots
+        self.prefix = prefix
+        self.directory: Path | None = None
+        self._next = 0
+
+    def path(self, suffix: str = "") -> Path:
+        """
+        The next scratch path, with no file at it: some tools (e.g. scrot)
+        pick another name rather than overwrite.
+        """
+        if self.directory is None:
+            self.directory = _make_directory(self.prefix)
+            atexit.register(self.close)
+        path = self.directory / f"{self._next}{suffix}"
+        self._next = (self._next + 1) % self.slots
+        path.unlink(missing_ok=True)
+        return path
+
+    def close(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            atexit.unregister(self.close)
+            self.directory = None
+
+
+def _make_directory(prefix: str) -> Path:
+    if os.access(TMPFS_DIR, os.W_OK):
+        return Path(tempfile.mkdtemp(prefix=f"{prefix}-", dir=TMPFS_DIR))
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f"{prefix}-", dir=OUTPUT_DIR))
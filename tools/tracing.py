@@ -0,0 +1,131 @@
+"""
+Timing spans for the agent loop and the tools.
+
+Spans are cheap no-ops until tracing is enabled, either with `tracer.configure()`
+or by setting AIFOR_TRACE_DIR. Once enabled, every span is kept in memory and
+`tracer.flush()` writes them to the trace directory as:
+
+- <run id>.trace.json, in Chrome trace-event format (chrome://tracing, Perfetto)
+- <run id>.spans.jsonl, one {"run", "name", "start_ms", "dur_ms", "args"} line per span
+
+`python trace_stats.py <dir or files>` aggregates the JSONL files of many runs.
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+TRACE_DIR_ENV = "AIFOR_TRACE_DIR"
+
+
+class Tracer:
+    """Collects timing spans of one run."""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_dir: Path | None = None
+        self.run_id = ""
+        self._events: list[dict[str, Any]] = []
+        self._origin = time.perf_counter()
+        # Chrome traces want integer thread ids, we give one per asyncio task
+        self._tids: dict[Any, int] = {}
+
+    def configure(self, trace_dir: str | Path, run_id: str | None = None):
+        """Start recording spans, to be written to `trace_dir` on flush."""
+        self.trace_dir = Path(trace_dir)
+        self.run_id = run_id or f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[dict[str, Any]]:
+        """
+        Time the enclosed block under `name`. Yields the span's args, which the
+        block may add to, e.g. with what it measured.
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            self._events.append(
+                {
+                    "name": name,
+                    "cat": name.split(".", 1)[0],
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": self._tid(),
+                    "args": args,
+                }
+            )
+
+    def _tid(self) -> int:
+        try:
+            key: Any = asyncio.current_task()
+        except RuntimeError:
+            key = None
+        if key is None:
+            key = threading.get_ident()
+        if (tid := self._tids.get(key)) is None:
+            tid = self._tids[key] = len(self._tids) + 1
+            name = key.get_name() if isinstance(key, asyncio.Task) else f"thread {key}"
+            self._events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        return tid
+
+    def flush(self):
+        """Write the spans recorded so far and forget them."""
+        if not self.enabled or not self._events or self.trace_dir is None:
+            return
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        events, self._events = self._events, []
+        trace_path = self.trace_dir / f"{self.run_id}.trace.json"
+        # a run may flush several times, keep every event in the trace file
+        previous = []
+        if trace_path.exists():
+            previous = json.loads(trace_path.read_text())["traceEvents"]
+        trace_path.write_text(json.dumps({"traceEvents": previous + events}))
+        with (self.trace_dir / f"{self.run_id}.spans.jsonl").open("a") as f:
+            for event in events:
+                if event["ph"] != "X":
+                    continue
+                f.write(
+                    json.dumps(
+                        {
+                            "run": self.run_id,
+                            "name": event["name"],
+                            "start_ms": round(event["ts"] / 1000, 3),
+                            "dur_ms": round(event["dur"] / 1000, 3),
+                            "args": event["args"],
+                        },
+                        default=str,
+                    )
+                    + "\n"
+                )
+
+
+tracer = Tracer()
+span = tracer.span
+
+if trace_dir := os.getenv(TRACE_DIR_ENV):
+    tracer.configure(trace_dir)
+atexit.register(tracer.flush)
@@ -0,0 +1,345 @@
+"""
+Minimal ctypes bindings to Xlib and its MIT-SHM and XTEST extensions.
+
+They let the computer tool talk to the X server in-process instead of forking a
+helper for every screenshot or input event. Nothing here is required: when the libraries or the
+display are not available, `XDisplay.open()` returns None and callers fall back
+to the command line tools.
+"""
+
+import ctypes
+import ctypes.util
+from ctypes import (
+    CFUNCTYPE,
+    POINTER,
+    Structure,
+    c_char_p,
+    c_int,
+    c_ubyte,
+    c_uint,
+    c_ulong,
+    c_void_p,
+)
+
+Z_PIXMAP = 2
+ALL_PLANES = 0xFFFFFFFF
+LSB_FIRST = 0
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+
+class XImage(Structure):
+    # only the leading fields we read, the struct is always allocated by Xlib
+    _fields_ = [
+        ("width", c_int),
+        ("height", c_int),
+        ("xoffset", c_int),
+        ("format", c_int),
+        ("data", c_void_p),
+        ("byte_order", c_int),
+        ("bitmap_unit", c_int),
+        ("bitmap_bit_order", c_int),
+        ("bitmap_pad", c_int),
+        ("depth", c_int),
+        ("bytes_per_line", c_int),
+        ("bits_per_pixel", c_int),
+        ("red_mask", c_ulong),
+        ("green_mask", c_ulong),
+        ("blue_mask", c_ulong),
+    ]
+
+
+class XShmSegmentInfo(Structure):
+    _fields_ = [
+        ("shmseg", c_ulong),
+        ("shmid", c_int),
+        ("shmaddr", c_void_p),
+        ("readOnly", c_int),
+    ]
+
+
+class XErrorEvent(Structure):
+    _fields_ = [
+        ("type", c_int),
+        ("display", c_void_p),
+        ("resourceid", c_ulong),
+        ("serial", c_ulong),
+        ("error_code", ctypes.c_ubyte),
+        ("request_code", ctypes.c_ubyte),
+        ("minor_code", ctypes.c_ubyte),
+    ]
+
+
+def _load(name: str) -> ctypes.CDLL | None:
+    if (path := ctypes.util.find_library(name)) is None:
+        return None
+    try:
+        return ctypes.CDLL(path)
+    except OSError:
+        return None
+
+
+def _declare(lib: ctypes.CDLL, name: str, restype, *argtypes):
+    function = getattr(lib, name)
+    function.restype = restype
+    function.argtypes = argtypes
+
+
+_xlib: ctypes.CDLL | None = None
+_xext: ctypes.CDLL | None = None
+_xtst: ctypes.CDLL | None = None
+_libc: ctypes.CDLL | None = None
+_loaded = False
+
+_XErrorHandler = CFUNCTYPE(c_int, c_void_p, POINTER(XErrorEvent))
+
+# Xlib's default error handler exits the process, record errors instead
+_last_error: int = 0
+
+
+def _record_error(display, event) -> int:
+    global _last_error
+    _last_error = event.contents.error_code
+    return 0
+
+
+_error_handler = _XErrorHandler(_record_error)
+
+
+def _load_libraries():
+    """Find and bind the libraries on first use: find_library may run ldconfig."""
+    global _xlib, _xext, _xtst, _libc, _loaded
+    if _loaded:
+        return
+    _loaded = True
+    _xlib = _load("X11")
+    _xext = _load("Xext")
+    _xtst = _load("Xtst")
+    _libc = _load("c")
+
+    if _xlib is not None:
+        _declare(_xlib, "XOpenDisplay", c_void_p, c_char_p)
+        _declare(_xlib, "XCloseDisplay", c_int, c_void_p)
+        _declare(_xlib, "XDefaultScreen", c_int, c_void_p)
+        _declare(_xlib, "XRootWindow", c_ulong, c_void_p, c_int)
+        _declare(_xlib, "XDefaultVisual", c_void_p, c_void_p, c_int)
+        _declare(_xlib, "XDefaultDepth", c_int, c_void_p, c_int)
+        _declare(_xlib, "XDisplayWidth", c_int, c_void_p, c_int)
+        _declare(_xlib, "XDisplayHeight", c_int, c_void_p, c_int)
+        _declare(_xlib, "XSync", c_int, c_void_p, c_int)
+        _declare(_xlib, "XFlush", c_int, c_void_p)
+        _declare(_xlib, "XFree", c_int, c_void_p)
+        _declare(
+            _xlib, "XGetImage", POINTER(XImage),
+            c_void_p, c_ulong, c_int, c_int, c_uint, c_uint, c_ulong, c_int,
+        )
+        _declare(_xlib, "XStringToKeysym", c_ulong, c_char_p)
+        _declare(_xlib, "XKeysymToKeycode", c_ubyte, c_void_p, c_ulong)
+        _declare(_xlib, "XkbKeycodeToKeysym", c_ulong, c_void_p, c_ubyte, c_int, c_int)
+        _declare(
+            _xlib, "XQueryPointer", c_int,
+            c_void_p, c_ulong, POINTER(c_ulong), POINTER(c_ulong),
+            POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_uint),
+        )
+        _declare(_xlib, "XSetErrorHandler", c_void_p, _XErrorHandler)
+
+    if _xext is not None:
+        _declare(_xext, "XShmQueryExtension", c_int, c_void_p)
+        _declare(
+            _xext, "XShmCreateImage", POINTER(XImage),
+            c_void_p, c_void_p, c_uint, c_int, c_void_p, POINTER(XShmSegmentInfo), c_uint, c_uint,
+        )
+        _declare(_xext, "XShmAttach", c_int, c_void_p, POINTER(XShmSegmentInfo))
+        _declare(_xext, "XShmDetach", c_int, c_void_p, POINTER(XShmSegmentInfo))
+        _declare(
+            _xext, "XShmGetImage", c_int,
+            c_void_p, c_ulong, POINTER(XImage), c_int, c_int, c_ulong,
+        )
+
+    if _xtst is not None:
+        _declare(
+            _xtst, "XTestQueryExtension", c_int,
+            c_void_p, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int),
+        )
+        _declare(_xtst, "XTestFakeMotionEvent", c_int, c_void_p, c_int, c_int, c_int, c_ulong)
+        _declare(_xtst, "XTestFakeButtonEvent", c_int, c_void_p, c_uint, c_int, c_ulong)
+        _declare(_xtst, "XTestFakeKeyEvent", c_int, c_void_p, c_uint, c_int, c_ulong)
+
+    if _libc is not None:
+        _declare(_libc, "shmget", c_int, c_int, ctypes.c_size_t, c_int)
+        _declare(_libc, "shmat", c_void_p, c_int, c_void_p, c_int)
+        _declare(_libc, "shmdt", c_int, c_void_p)
+        _declare(_libc, "shmctl", c_int, c_int, c_int, c_void_p)
+
+    if _xlib is not None:
+        _xlib.XSetErrorHandler(_error_handler)
+
+
+class XError(Exception):
+    """Raised when the X server rejects a request."""
+
+
+class XDisplay:
+    """A connection to one X display."""
+
+    def __init__(self, handle: int):
+        assert _xlib is not None
+        self.xlib = _xlib
+        self.handle = handle
+        self.screen = _xlib.XDefaultScreen(handle)
+        self.root = _xlib.XRootWindow(handle, self.screen)
+
+    @classmethod
+    def open(cls, display_num: int | None = None) -> "XDisplay | None":
+        """Connect to `:display_num`, or to $DISPLAY; None if Xlib or the display is unavailable."""
+        _load_libraries()
+        if _xlib is None:
+            return None
+        name = f":{display_num}".encode() if display_num is not None else None
+        if not (handle := _xlib.XOpenDisplay(name)):
+            return None
+        return cls(handle)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return (
+            self.xlib.XDisplayWidth(self.handle, self.screen),
+            self.xlib.XDisplayHeight(self.handle, self.screen),
+        )
+
+    @property
+    def has_shm(self) -> bool:
+        return (
+            _xext is not None
+            and _libc is not None
+            and bool(_xext.XShmQueryExtension(self.handle))
+        )
+
+    @property
+    def has_xtest(self) -> bool:
+        if _xtst is None:
+            return False
+        unused = c_int()
+        return bool(
+            _xtst.XTestQueryExtension(
+                self.handle, *(ctypes.byref(unused) for _ in range(4))
+            )
+        )
+
+    @property
+    def xtest(self) -> ctypes.CDLL:
+        assert _xtst is not None
+        return _xtst
+
+    def pointer(self) -> tuple[int, int]:
+        """Position of the pointer on the screen."""
+        window, child = c_ulong(), c_ulong()
+        x, y, window_x, window_y = c_int(), c_int(), c_int(), c_int()
+        mask = c_uint()
+        self.xlib.XQueryPointer(
+            self.handle, self.root, ctypes.byref(window), ctypes.byref(child),
+            ctypes.byref(x), ctypes.byref(y), ctypes.byref(window_x), ctypes.byref(window_y),
+            ctypes.byref(mask),
+        )
+        return x.value, y.value
+
+    def sync(self):
+        """Wait for the server to process every request, raising XError if one failed."""
+        global _last_error
+        _last_error = 0
+        self.xlib.XSync(self.handle, 0)
+        if _last_error:
+            code, _last_error = _last_error, 0
+            raise XError(f"X request failed with error code {code}")
+
+    def close(self):
+        if self.handle:
+            self.xlib.XCloseDisplay(self.handle)
+            self.handle = 0
+
+
+class ShmImage:
+    """A shared memory XImage the server writes screen contents into directly."""
+
+    def __init__(self, display: XDisplay, width: int, height: int):
+        assert _xext is not None and _libc is not None
+        self.display = display
+        self.info = XShmSegmentInfo()
+        self.image = _xext.XShmCreateImage(
+            display.handle,
+            display.xlib.XDefaultVisual(display.handle, display.screen),
+            display.xlib.XDefaultDepth(display.handle, display.screen),
+            Z_PIXMAP,
+            None,
+            ctypes.byref(self.info),
+            width,
+            height,
+        )
+        if not self.image:
+            raise XError("XShmCreateImage failed")
+        size = self.image.contents.bytes_per_line * height
+        self.info.shmid = _libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if self.info.shmid < 0:
+            display.xlib.XFree(self.image)
+            raise XError("shmget failed")
+        address = _libc.shmat(self.info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            _libc.shmctl(self.info.shmid, IPC_RMID, None)
+            display.xlib.XFree(self.image)
+            raise XError("shmat failed")
+        self.info.shmaddr = address
+        self.info.readOnly = 0
+        self.image.contents.data = address
+        attached = bool(_xext.XShmAttach(display.handle, ctypes.byref(self.info)))
+        try:
+            # e.g. BadAccess when the server runs on another machine
+            display.sync()
+        except XError:
+            attached = False
+        finally:
+            # the segment goes away once both sides detach, even if we crash
+            _libc.shmctl(self.info.shmid, IPC_RMID, None)
+        if not attached:
+            self._release(detach=False)
+            raise XError("XShmAttach failed")
+
+    def grab(self, x: int = 0, y: int = 0) -> XImage:
+        """Copy the screen area at (x, y) into the shared image."""
+        assert _xext is not None
+        if not _xext.XShmGetImage(
+            self.display.handle, self.display.root, self.image, x, y, ALL_PLANES
+        ):
+            raise XError("XShmGetImage failed")
+        return self.image.contents
+
+    def close(self):
+        if self.image:
+            self._release(detach=True)
+
+    def _release(self, detach: bool):
+        assert _xext is not None and _libc is not None
+        if detach:
+            _xext.XShmDetach(self.display.handle, ctypes.byref(self.info))
+            self.display.xlib.XSync(self.display.handle, 0)
+        _libc.shmdt(self.info.shmaddr)
+        # the data is ours, not malloc'ed by Xlib: free only the struct
+        self.image.contents.data = None
+        self.display.xlib.XFree(self.image)
+        self.image = None
+
+
+def get_image(display: XDisplay, x: int, y: int, width: int, height: int) -> tuple[XImage, bytes]:
+    """Fetch a screen area with a plain XGetImage round-trip, returning the image header and its data."""
+    image = display.xlib.XGetImage(
+        display.handle, display.root, x, y, width, height, ALL_PLANES, Z_PIXMAP
+    )
+    if not image:
+        raise XError("XGetImage failed")
+    try:
+        header = XImage.from_buffer_copy(image.contents)
+        data = ctypes.string_at(header.data, header.bytes_per_line * header.height)
+    finally:
+        display.xlib.XFree(image.contents.data)
+        display.xlib.XFree(image)
+    return header, data
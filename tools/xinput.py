@@ -0,0 +1,158 @@
+"""
+In-process keyboard and mouse input through the XTEST extension.
+
+XTestInput covers what ComputerTool asks of xdotool without a process per
+action. It only handles input it can map exactly: key names and characters
+without a keycode in the current keymap (which xdotool remaps on the fly) are
+reported as unsupported before any event is sent, so the caller can hand the
+whole action over to xdotool instead.
+"""
+
+import asyncio
+
+from .x11 import XDisplay
+
+SHIFT_L = 0xFFE1
+RETURN = 0xFF0D
+TAB = 0xFF09
+
+# the modifier aliases xdotool accepts, compared case-insensitively
+KEY_ALIASES = {
+    "alt": "Alt_L",
+    "ctrl": "Control_L",
+    "control": "Control_L",
+    "meta": "Meta_L",
+    "super": "Super_L",
+    "shift": "Shift_L",
+}
+
+
+class XTestInput:
+    """
+    Fake input events on one X display. Actions return whether they were
+    performed, and raise XError if the server rejected them.
+    """
+
+    def __init__(self, display: XDisplay):
+        self.display = display
+        self.xtest = display.xtest
+        self._shift = display.xlib.XKeysymToKeycode(display.handle, SHIFT_L)
+
+    @classmethod
+    def open(cls, display_num: int | None) -> "XTestInput | None":
+        """Connect to the display, or None when it or XTEST is unavailable."""
+        if (display := XDisplay.open(display_num)) is None:
+            return None
+        if not display.has_xtest:
+            display.close()
+            return None
+        return cls(display)
+
+    def close(self):
+        self.display.close()
+
+    def pointer(self) -> tuple[int, int]:
+        return self.display.pointer()
+
+    async def move(self, x: int, y: int) -> bool:
+        """Move the pointer, returning once the server has processed it."""
+        self._move(x, y)
+        return True
+
+    async def drag(self, x: int, y: int, button: int = 1) -> bool:
+        """Press `button`, move to (x, y) and release it."""
+        self.xtest.XTestFakeButtonEvent(self.display.handle, button, True, 0)
+        self._move(x, y)
+        self.xtest.XTestFakeButtonEvent(self.display.handle, button, False, 0)
+        self.display.sync()
+        return True
+
+    async def click(self, button: int, repeat: int = 1, delay: float = 0.0) -> bool:
+        for i in range(repeat):
+            if i:
+                await asyncio.sleep(delay)
+            self.xtest.XTestFakeButtonEvent(self.display.handle, button, True, 0)
+            self.xtest.XTestFakeButtonEvent(self.display.handle, button, False, 0)
+            self.display.sync()
+        return True
+
+    async def key(self, text: str, delay: float) -> bool:
+        """
+        Press space separated key combinations like "ctrl+shift+t Return", as
+        `xdotool key` does. Returns False, without sending anything, if a key
+        can't be mapped.
+        """
+        combos = []
+        for combo in text.split():
+            keycodes: list[int] = []
+            for name in combo.split("+"):
+                if (codes := self._name_keycodes(name)) is None:
+                    return False
+                keycodes += codes
+            combos.append(keycodes)
+        if not combos:
+            return False
+        for i, keycodes in enumerate(combos):
+            if i:
+                await asyncio.sleep(delay)
+            self._press(keycodes)
+        return True
+
+    async def type(self, text: str, delay: float) -> bool:
+        """
+        Type `text` with `delay` seconds between characters. Returns False,
+        without sending anything, if a character can't be mapped.
+        """
+        characters = []
+        for char in text:
+            if (keycodes := self._keysym_keycodes(_char_keysym(char))) is None:
+                return False
+            characters.append(keycodes)
+        for i, keycodes in enumerate(characters):
+            if i:
+                await asyncio.sleep(delay)
+            self._press(keycodes)
+        return True
+
+    def _move(self, x: int, y: int):
+        self.xtest.XTestFakeMotionEvent(self.display.handle, self.display.screen, x, y, 0)
+        self.display.sync()
+
+    def _press(self, keycodes: list[int]):
+        """Press the keys in order and release them in reverse."""
+        for keycode in keycodes:
+            self.xtest.XTestFakeKeyEvent(self.display.handle, keycode, True, 0)
+        for keycode in reversed(keycodes):
+            self.xtest.XTestFakeKeyEvent(self.display.handle, keycode, False, 0)
+        self.display.sync()
+
+    def _name_keycodes(self, name: str) -> list[int] | None:
+        name = KEY_ALIASES.get(name.lower(), name)
+        keysym = self.display.xlib.XStringToKeysym(name.encode())
+        if not keysym:
+            return None
+        return self._keysym_keycodes(keysym)
+
+    def _keysym_keycodes(self, keysym: int) -> list[int] | None:
+        """The keys to press for a keysym: its keycode, after Shift if it's on the shifted level."""
+        xlib, handle = self.display.xlib, self.display.handle
+        if not (keycode := xlib.XKeysymToKeycode(handle, keysym)):
+            return None
+        if xlib.XkbKeycodeToKeysym(handle, keycode, 0, 0) == keysym:
+            return [keycode]
+        if self._shift and xlib.XkbKeycodeToKeysym(handle, keycode, 0, 1) == keysym:
+            return [self._shift, keycode]
+        # e.g. on an AltGr level
+        return None
+
+
+def _char_keysym(char: str) -> int:
+    if char == "\n":
+        return RETURN
+    if char == "\t":
+        return TAB
+    codepoint = ord(char)
+    # Latin-1 keysyms are the code points, other characters have Unicode keysyms
+    if 0x20 <= codepoint <= 0x7E or 0xA0 <= codepoint <= 0xFF:
+        return codepoint
+    return 0x01000000 | codepoint
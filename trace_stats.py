@@ -0,0 +1,73 @@
+#!/bin/python
+"""
+Aggregate the span summaries written by tools.tracing across runs.
+
+    python trace_stats.py debug/traces/            # every *.spans.jsonl in the directory
+    python trace_stats.py a.spans.jsonl b.spans.jsonl --sort p95
+
+Prints, per span name, the number of spans, the p50/p95/max duration and the
+total time spent, in milliseconds.
+"""
+
+import argparse
+import json
+import math
+from collections import defaultdict
+from pathlib import Path
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def load_durations(paths: list[Path]) -> tuple[dict[str, list[float]], set[str]]:
+    durations: dict[str, list[float]] = defaultdict(list)
+    runs: set[str] = set()
+    for path in paths:
+        files = sorted(path.glob("*.spans.jsonl")) if path.is_dir() else [path]
+        for file in files:
+            with file.open() as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    durations[record["name"]].append(record["dur_ms"])
+                    runs.add(record["run"])
+    return durations, runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles across traced runs")
+    parser.add_argument("paths", nargs="+", type=Path, help="*.spans.jsonl files or directories holding them")
+    parser.add_argument("--sort", choices=["name", "count", "p50", "p95", "total"], default="total")
+    args = parser.parse_args()
+
+    durations, runs = load_durations(args.paths)
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append(
+            {
+                "name": name,
+                "count": len(values),
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "max": values[-1],
+                "total": sum(values),
+            }
+        )
+    rows.sort(key=lambda row: row[args.sort], reverse=args.sort != "name")
+
+    print(f"{len(runs)} runs")
+    print(f"{'stage':<28}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}{'total s':>12}")
+    for row in rows:
+        print(
+            f"{row['name']:<28}{row['count']:>8}{row['p50']:>12.1f}{row['p95']:>12.1f}"
+            f"{row['max']:>12.1f}{row['total'] / 1000:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()